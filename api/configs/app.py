@@ -1,6 +1,7 @@
 # TODO сюда вынести все константы через os.getenv и потом из этого файла импортировать в другие файлы
 import os
 import redis
+import redis.asyncio as aioredis
 import json
 
 
@@ -93,6 +94,31 @@ DEFAULT_WRITE_VIDEO = os.getenv("DEFAULT_WRITE_VIDEO", "False").lower() == "true
 # сохранять обнаруженные объекты в бд, не более раз в n секунд
 # ------------------------------------------------------------
 DEFAULT_ALERT_SAVE_TIMEOUT = int(os.getenv("DEFAULT_ALERT_SAVE_TIMEOUT", 5))
+# сколько тревог можно передать в одном запросе alerts/bulk/
+ALERT_BULK_MAX_ITEMS = int(os.getenv("ALERT_BULK_MAX_ITEMS", 500))
+# пагинация списка тревог по умолчанию: offset (limit/offset с count) или cursor (по курсору, без count);
+# курсорный режим также включается параметром запроса cursor или pagination=cursor
+ALERT_PAGINATION_MODE = os.getenv("ALERT_PAGINATION_MODE", "offset").lower()
+# максимальный limit страницы в курсорном режиме
+ALERT_CURSOR_MAX_LIMIT = int(os.getenv("ALERT_CURSOR_MAX_LIMIT", 1000))
+# поле JSON message тревоги с классом обнаруженного объекта (строка или список), по нему фильтр class
+ALERT_MESSAGE_CLASS_FIELD = os.getenv("ALERT_MESSAGE_CLASS_FIELD", "class")
+
+# запись тревог: sync - в запросе alerts/, stream - запрос только добавляет тревогу в redis stream
+# и отвечает 202, в бд её пишет воркер (manage.py run_alert_writer)
+ALERT_INGESTION_MODE = os.getenv("ALERT_INGESTION_MODE", "sync").lower()
+ALERT_STREAM_KEY = os.getenv("ALERT_STREAM_KEY", "alerts_ingest")
+ALERT_STREAM_GROUP = os.getenv("ALERT_STREAM_GROUP", "alert_writers")
+# примерная максимальная длина stream (XADD MAXLEN ~), защита redis от переполнения при остановленном воркере
+ALERT_STREAM_MAXLEN = int(os.getenv("ALERT_STREAM_MAXLEN", 1000000))
+# сколько тревог воркер пишет в бд за раз и сколько мс ждёт новых
+ALERT_STREAM_BATCH_SIZE = int(os.getenv("ALERT_STREAM_BATCH_SIZE", 200))
+ALERT_STREAM_BLOCK_MS = int(os.getenv("ALERT_STREAM_BLOCK_MS", 1000))
+# через сколько мс неподтверждённые тревоги упавшего воркера забирает другой воркер
+ALERT_STREAM_CLAIM_IDLE_MS = int(os.getenv("ALERT_STREAM_CLAIM_IDLE_MS", 60000))
+# после скольких доставок тревога, которую бд не принимает, уходит в отдельный stream и больше не повторяется
+ALERT_STREAM_MAX_DELIVERIES = int(os.getenv("ALERT_STREAM_MAX_DELIVERIES", 5))
+ALERT_STREAM_DEAD_LETTER_KEY = os.getenv("ALERT_STREAM_DEAD_LETTER_KEY", "alerts_ingest_dead")
 
 
 # список детектируемых стандартных yolo классов
@@ -127,4 +153,109 @@ REDIS_POOL = redis.ConnectionPool(
     health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
 )
 
-redis_client = redis.Redis(connection_pool=REDIS_POOL)
\ No newline at end of file
+redis_client = redis.Redis(connection_pool=REDIS_POOL)
+
+# отдельный пул для asyncio-клиента, которым пользуются websocket сервисы
+# (синхронный клиент внутри event loop блокирует все сокеты процесса).
+# ответы всегда в байтах: сырые данные камер пересылаются клиентам без декодирования
+ASYNC_REDIS_POOL = aioredis.ConnectionPool(
+    host=REDIS_HOST,
+    port=REDIS_PORT,
+    db=REDIS_DB,
+    decode_responses=False,
+    socket_timeout=REDIS_SOCKET_TIMEOUT,
+    socket_keepalive=REDIS_SOCKET_KEEPALIVE,
+    health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+)
+
+async_redis_client = aioredis.Redis(connection_pool=ASYNC_REDIS_POOL)
+
+# настройки раздачи данных из redis в websocket
+# ---------------------------------------------
+# период опроса ключей камер в redis общим опросчиком (секунды)
+GET_DATA_FROM_REDIS_TO_SOCKET_SLEEP_TIME = float(os.getenv('GET_DATA_FROM_REDIS_TO_SOCKET_SLEEP_TIME', 0.1))
+
+# режим общего опросчика: poll - опрос по таймеру, push - чтение ключа сразу после его обновления
+# (keyspace notifications redis или публикация имени ключа nn контейнером в REDIS_HUB_UPDATES_CHANNEL)
+REDIS_HUB_MODE = os.getenv('REDIS_HUB_MODE', 'poll').lower()
+REDIS_HUB_UPDATES_CHANNEL = os.getenv('REDIS_HUB_UPDATES_CHANNEL', 'nn_data_updates')
+# в push режиме: страховочный полный опрос, если уведомления не приходили N секунд
+REDIS_HUB_FALLBACK_POLL_INTERVAL = float(os.getenv('REDIS_HUB_FALLBACK_POLL_INTERVAL', 1.0))
+# в push режиме: окно, за которое пачка уведомлений схлопывается в одно чтение
+REDIS_HUB_PUSH_COALESCE_TIME = float(os.getenv('REDIS_HUB_PUSH_COALESCE_TIME', 0.005))
+# если задано (например "K$"), при старте выставляется notify-keyspace-events в redis
+REDIS_NOTIFY_KEYSPACE_EVENTS = os.getenv('REDIS_NOTIFY_KEYSPACE_EVENTS', '')
+
+# виды данных, которые пересылаются клиентам сырыми байтами из redis, без json.loads/json.dumps
+WEBSOCKET_RAW_PASSTHROUGH_KINDS = [
+    kind.strip() for kind in os.getenv('WEBSOCKET_RAW_PASSTHROUGH_KINDS', 'frame,thumbnail').split(',') if kind.strip()
+]
+
+# поля данных камеры с base64 изображением, которые бинарный протокол websocket отдаёт сырым JPEG
+WEBSOCKET_BINARY_IMAGE_FIELDS = [
+    field.strip() for field in os.getenv('WEBSOCKET_BINARY_IMAGE_FIELDS', 'frame,thumbnail,image').split(',') if field.strip()
+]
+
+# сколько сообщений может быть отправлено websocket клиенту без подтверждения,
+# если клиент включил подтверждения ("ack": true в первом сообщении)
+WEBSOCKET_MAX_IN_FLIGHT = int(os.getenv('WEBSOCKET_MAX_IN_FLIGHT', 2))
+
+# камеры websocket алертов и миниатюр для клиентов, которые не присылают свой camera_list
+WEBSOCKET_CAMERA_LIST = json.loads(os.getenv('WEBSOCKET_CAMERA_LIST')) if os.getenv('WEBSOCKET_CAMERA_LIST') else []
+
+# раздача между процессами daphne: local - каждый процесс сам опрашивает redis по камерам своих клиентов,
+# channel_layer - камеру опрашивает один выбранный процесс и публикует данные в группы channel layer
+# camera.<id>.<вид данных>, клиенты остальных процессов получают данные из этих групп
+WEBSOCKET_FANOUT_MODE = os.getenv('WEBSOCKET_FANOUT_MODE', 'local').lower()
+# как часто процесс продлевает/захватывает лидерство по камерам (секунды)
+WEBSOCKET_FANOUT_ELECTION_INTERVAL = float(os.getenv('WEBSOCKET_FANOUT_ELECTION_INTERVAL', 1.0))
+# через сколько секунд без продления лидерство освобождается (упавший процесс)
+WEBSOCKET_FANOUT_LEADER_TTL = float(os.getenv('WEBSOCKET_FANOUT_LEADER_TTL', 3.0))
+WEBSOCKET_FANOUT_LOCK_PREFIX = os.getenv('WEBSOCKET_FANOUT_LOCK_PREFIX', 'websocket_fanout_leader:')
+
+# websocket клиент, который начал слать ping и дольше N секунд ничего не присылал (ping, ack, подписка), закрывается
+WEBSOCKET_CLIENT_TIMEOUT = float(os.getenv('WEBSOCKET_CLIENT_TIMEOUT', 30))
+# шаг колеса таймеров, по которому проверяются сроки неактивности клиентов (секунды)
+WEBSOCKET_REAPER_TICK = float(os.getenv('WEBSOCKET_REAPER_TICK', 1.0))
+
+# уровни качества потока кадров, от лучшего к худшему: какой вид данных уходит клиенту
+# вместо кадра и с какой максимальной частотой (кадров/сек, 0 - без ограничения).
+# клиент выбирает уровень для камер сам ("tier"/"tiers"), при большой задержке отправки
+# сервер опускает все камеры клиента на уровень ниже, при малой - поднимает обратно
+WEBSOCKET_QUALITY_TIERS = json.loads(os.getenv('WEBSOCKET_QUALITY_TIERS')) if os.getenv('WEBSOCKET_QUALITY_TIERS') else {
+    "focus": {"kind": "frame", "fps": 10},
+    "grid": {"kind": "thumbnail", "fps": 2},
+    "background": {"kind": "thumbnail", "fps": 0.5},
+}
+# средняя задержка в очереди отправки (секунды), выше которой уровень понижается и ниже которой повышается
+# (только у клиентов с подтверждениями "ack": true)
+WEBSOCKET_TIER_DOWNGRADE_LAG = float(os.getenv('WEBSOCKET_TIER_DOWNGRADE_LAG', 0.5))
+WEBSOCKET_TIER_UPGRADE_LAG = float(os.getenv('WEBSOCKET_TIER_UPGRADE_LAG', 0.1))
+# как часто пересматривается уровень качества клиента (секунды)
+WEBSOCKET_TIER_ADAPT_INTERVAL = float(os.getenv('WEBSOCKET_TIER_ADAPT_INTERVAL', 5.0))
+
+# мозаика миниатюр ("mode": "mosaic" в сокете миниатюр, нужен Pillow): одна JPEG сетка
+# из миниатюр камер клиента, собирается один раз на обновление и общая для всех клиентов
+WEBSOCKET_MOSAIC_TILE_SIZE = tuple(map(int, os.getenv("WEBSOCKET_MOSAIC_TILE_SIZE", "320,180").split(',')))
+WEBSOCKET_MOSAIC_QUALITY = int(os.getenv("WEBSOCKET_MOSAIC_QUALITY", 70))
+# число столбцов мозаики, 0 - подбирается по числу камер (квадратная сетка)
+WEBSOCKET_MOSAIC_COLUMNS = int(os.getenv("WEBSOCKET_MOSAIC_COLUMNS", 0))
+# через сколько секунд без запросов мозаика для набора камер удаляется из кэша
+WEBSOCKET_MOSAIC_TTL = float(os.getenv("WEBSOCKET_MOSAIC_TTL", 60))
+
+# сколько разных наборов камер хранит общий кэш готовых текстовых сообщений websocket
+WEBSOCKET_ENVELOPE_CACHE_SIZE = int(os.getenv("WEBSOCKET_ENVELOPE_CACHE_SIZE", 1024))
+
+# сжатие текстовых потоков websocket по согласованию с клиентом ("compression": "deflate"):
+# для каких видов данных (кадры и миниатюры - уже сжатый JPEG), уровень zlib и размер
+# сообщения (байт), меньше которого сообщение уходит без сжатия
+WEBSOCKET_COMPRESSION_KINDS = json.loads(os.getenv("WEBSOCKET_COMPRESSION_KINDS", '["full", "alert"]'))
+WEBSOCKET_COMPRESSION_LEVEL = int(os.getenv("WEBSOCKET_COMPRESSION_LEVEL", 6))
+WEBSOCKET_COMPRESSION_MIN_SIZE = int(os.getenv("WEBSOCKET_COMPRESSION_MIN_SIZE", 128))
+
+# виды данных, которые клиент может получать изменениями ("delta": true в первом сообщении):
+# сначала полный снимок камеры, дальше JSON merge patch (RFC 7386) к последнему отправленному
+WEBSOCKET_DELTA_KINDS = json.loads(os.getenv("WEBSOCKET_DELTA_KINDS", '["full"]'))
+
+# сколько проверенных JWT access токенов хранится в кэше процесса (до истечения exp)
+JWT_VERIFICATION_CACHE_SIZE = int(os.getenv("JWT_VERIFICATION_CACHE_SIZE", 4096))
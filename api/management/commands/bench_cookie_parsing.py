@@ -0,0 +1,65 @@
+import timeit
+
+from django.core.management.base import BaseCommand
+
+from api.services.websocket_auth import get_access_token
+
+
+def legacy_access_token(scope):
+    """Прежний разбор в connect: словарь всех заголовков и словарь всех cookies."""
+    headers = dict(scope.get("headers", []))
+    cookie_header = headers.get(b'cookie', b'').decode('utf-8')
+    cookies = dict(item.split("=", 1) for item in cookie_header.split("; ") if "=" in item)
+    return cookies.get('access_token')
+
+
+def make_scope(cookie_count: int, token_position: str):
+    """Scope рукопожатия, похожий на браузерный: типичные заголовки и cookie_count cookies."""
+    cookies = [f"cookie_{i}={'x' * 32}" for i in range(cookie_count)]
+    token = "access_token=" + "eyJhbGciOiJIUzI1NiJ9." + "a" * 180 + ".signature"
+    if token_position == "first":
+        cookies.insert(0, token)
+    else:
+        cookies.append(token)
+    headers = [
+        (b"host", b"localhost:8000"),
+        (b"user-agent", b"Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko)"),
+        (b"accept-encoding", b"gzip, deflate, br"),
+        (b"accept-language", b"ru-RU,ru;q=0.9,en-US;q=0.8"),
+        (b"origin", b"http://localhost:3000"),
+        (b"sec-websocket-version", b"13"),
+        (b"sec-websocket-key", b"dGhlIHNhbXBsZSBub25jZQ=="),
+        (b"cookie", "; ".join(cookies).encode("latin-1")),
+        (b"upgrade", b"websocket"),
+        (b"connection", b"Upgrade"),
+    ]
+    return {"type": "websocket", "headers": headers, "query_string": b""}
+
+
+class Command(BaseCommand):
+    help = "Сравнивает скорость разбора access_token из рукопожатия websocket: прежний разбор и websocket_auth"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=100000, help="Число разборов в замере")
+        parser.add_argument("--cookies", type=int, nargs="+", default=[2, 10, 40],
+                            help="Сколько посторонних cookies в заголовке")
+
+    def handle(self, *args, **options):
+        iterations = options["iterations"]
+        for cookie_count in options["cookies"]:
+            for token_position in ("first", "last"):
+                scope = make_scope(cookie_count, token_position)
+                if legacy_access_token(scope) != get_access_token(scope):
+                    self.stderr.write(self.style.ERROR("Результаты разбора не совпадают"))
+                    return
+
+                legacy = min(timeit.repeat(lambda: legacy_access_token(scope), number=iterations, repeat=3))
+                current = min(timeit.repeat(lambda: get_access_token(scope), number=iterations, repeat=3))
+                self.stdout.write(
+                    f"cookies: {cookie_count:3d}, токен {token_position:5s} | "
+                    f"прежний: {legacy / iterations * 1e9:8.0f} нс | "
+                    f"websocket_auth: {current / iterations * 1e9:8.0f} нс | "
+                    f"ускорение: {legacy / current:5.1f}x"
+                )
+
+        self.stdout.write(self.style.SUCCESS("Замер завершён"))
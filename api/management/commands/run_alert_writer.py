@@ -0,0 +1,36 @@
+import os
+import socket
+
+from django.core.management.base import BaseCommand
+
+from api.configs.app import ALERT_STREAM_BATCH_SIZE, ALERT_STREAM_KEY
+from api.services.alert_stream import AlertStreamWriter
+from api.services.redis import RedisService
+
+
+class Command(BaseCommand):
+    help = "Записывает тревоги из redis stream в бд (ALERT_INGESTION_MODE=stream)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--consumer", default=f"{socket.gethostname()}:{os.getpid()}",
+                            help="Имя воркера в группе потребителей stream")
+        parser.add_argument("--batch-size", type=int, default=ALERT_STREAM_BATCH_SIZE,
+                            help="Сколько тревог записывать за раз")
+        parser.add_argument("--once", action="store_true",
+                            help="Записать всё, что есть в stream, и завершиться")
+
+    def handle(self, *args, **options):
+        redis_client = RedisService().get_redis_client()
+        if redis_client is None:
+            self.stderr.write(self.style.ERROR("Redis недоступен"))
+            return
+
+        writer = AlertStreamWriter(redis_client, options["consumer"], batch_size=options["batch_size"])
+        self.stdout.write(f"Воркер {options['consumer']} пишет тревоги из {ALERT_STREAM_KEY}")
+        try:
+            writer.run(once=options["once"])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(
+            f"Записано {writer.written}, повторов {writer.duplicates}, отклонено {writer.rejected}"
+        ))
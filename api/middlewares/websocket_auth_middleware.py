@@ -1,5 +1,5 @@
-from urllib.parse import parse_qs
-from rest_framework_simplejwt.tokens import AccessToken
+from api.services.jwt_cache import VerifiedTokenCache
+from api.services.websocket_auth import get_header, get_query_param
 
 import os
 import json
@@ -11,14 +11,12 @@ class WebSocketAuthMiddleware:
         self.inner = inner
 
     async def __call__(self, scope, receive, send):
-        query_params = parse_qs(scope["query_string"].decode("utf8"))
-        token = query_params.get("token", [None])[0] or ""
+        token = get_query_param(scope, "token") or ""
 
         if not token:
-            headers = dict(scope.get("headers", []))
-            auth_header = headers.get(b"authorization", b"").decode("utf8")
+            auth_header = get_header(scope, b"authorization")
             if auth_header:
-                token = auth_header
+                token = auth_header.decode("utf8")
 
         if token and self.authenticate_token(token):
             scope["user"] = "authenticated"
@@ -35,7 +33,7 @@ class WebSocketAuthMiddleware:
         try:
             if token.startswith("Bearer "):
                 jwt_token = token.split("Bearer ")[-1]
-                AccessToken(jwt_token)
+                VerifiedTokenCache().validate(jwt_token)
                 return True
 
             if token.startswith("Token "):
@@ -0,0 +1,33 @@
+from django.db import migrations
+
+
+# последовательность для AlertData.number (api.services.postgres_db.ALERT_NUMBER_SEQUENCE)
+ALERT_NUMBER_SEQUENCE = "api_alertdata_number_seq"
+
+
+def create_number_sequence(apps, schema_editor):
+    # в SQLite последовательностей нет, номера считаются от максимального
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    # последовательность продолжает уже выданные номера
+    schema_editor.execute(f"CREATE SEQUENCE IF NOT EXISTS {ALERT_NUMBER_SEQUENCE} AS bigint")
+    schema_editor.execute(
+        f"SELECT setval('{ALERT_NUMBER_SEQUENCE}', COALESCE((SELECT MAX(number) FROM api_alertdata), 0) + 1, false)"
+    )
+
+
+def drop_number_sequence(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(f"DROP SEQUENCE IF EXISTS {ALERT_NUMBER_SEQUENCE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_alter_alertdata_options_alertdata_number_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_number_sequence, drop_number_sequence),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_alertdata_number_sequence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='alertdata',
+            name='idempotency_key',
+            field=models.CharField(blank=True, help_text='ключ повторной доставки: тревога с тем же ключом не записывается дважды', max_length=64, null=True, unique=True),
+        ),
+    ]
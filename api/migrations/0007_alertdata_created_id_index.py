@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_alertdata_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='alertdata',
+            index=models.Index(fields=['-created_at', '-id'], name='alert_created_id_idx'),
+        ),
+    ]
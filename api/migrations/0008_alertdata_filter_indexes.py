@@ -0,0 +1,43 @@
+from django.db import migrations, models
+
+
+# GIN индекс по message для фильтра по полям JSON (message @> '{"class": ...}').
+# В SQLite таких индексов нет, поэтому индекс создаётся только в Postgres и не описан в модели.
+MESSAGE_GIN_INDEX = "alert_message_gin_idx"
+
+
+def create_message_gin_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(
+        f"CREATE INDEX IF NOT EXISTS {MESSAGE_GIN_INDEX} ON api_alertdata USING gin (message jsonb_path_ops)"
+    )
+
+
+def drop_message_gin_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(f"DROP INDEX IF EXISTS {MESSAGE_GIN_INDEX}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_alertdata_created_id_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='alertdata',
+            index=models.Index(fields=['camera', '-created_at', '-id'], name='alert_camera_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='alertdata',
+            index=models.Index(fields=['camera', '-first_detection_datetime'], name='alert_camera_first_det_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='alertdata',
+            index=models.Index(fields=['camera', '-last_detection_datetime'], name='alert_camera_last_det_idx'),
+        ),
+        migrations.RunPython(create_message_gin_index, drop_message_gin_index),
+    ]
@@ -55,6 +55,24 @@ class AlertData(models.Model):
     image = models.TextField(null=True, blank=True, db_index=True)
     created_at = models.DateTimeField(auto_now_add=True, db_index=True)
     updated_at = models.DateTimeField(auto_now=True, db_index=True)
+    idempotency_key = models.CharField(
+        max_length=64,
+        blank=True,
+        null=True,
+        unique=True,
+        help_text="ключ повторной доставки: тревога с тем же ключом не записывается дважды"
+    )
+
+    class Meta:
+        indexes = [
+            # курсорная пагинация списка тревог: ORDER BY created_at DESC, id DESC
+            models.Index(fields=['-created_at', '-id'], name='alert_created_id_idx'),
+            # фильтры списка тревог: камера и окно времени обнаружения или создания
+            models.Index(fields=['camera', '-created_at', '-id'], name='alert_camera_created_idx'),
+            models.Index(fields=['camera', '-first_detection_datetime'], name='alert_camera_first_det_idx'),
+            models.Index(fields=['camera', '-last_detection_datetime'], name='alert_camera_last_det_idx'),
+            # GIN индекс по message для фильтра по классу создаётся миграцией 0008 только в Postgres
+        ]
 
     def __str__(self):
         return f"Alert from {self.camera} at {self.created_at}"
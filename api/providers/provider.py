@@ -1,9 +1,12 @@
 from api.services.redis import RedisService
+from api.services.async_redis import AsyncRedisService
+from api.services.redis_hub import RedisPollerHub
 from api.services.websocket import WebSocketService
 from api.metaclasses.singletone import Singletone
 from api.services.thumbnail_websocket import ThumbnailWebSocketService
 from api.services.frame_websocket import FrameWebSocketService
 from api.services.alert_websocket import AlertWebSocketService
+from api.services.multi_stream_websocket import MultiStreamWebSocketService
 
 
 class Provider(metaclass=Singletone):
@@ -16,21 +19,34 @@ class Provider(metaclass=Singletone):
     def get_redis_service() -> RedisService:
         return RedisService()
 
+    @staticmethod
+    def get_async_redis_service() -> AsyncRedisService:
+        return AsyncRedisService()
+
+    @staticmethod
+    def get_redis_poller_hub() -> RedisPollerHub:
+        return RedisPollerHub(AsyncRedisService())
+
     @staticmethod
     def get_websocket_service() -> WebSocketService:
-        return WebSocketService(RedisService())
+        return WebSocketService(AsyncRedisService())
 
 
     @staticmethod
     def get_alert_websocket_service() -> AlertWebSocketService:
-        return AlertWebSocketService(RedisService())
+        return AlertWebSocketService(AsyncRedisService())
     
     
     @staticmethod
     def get_frame_websocket_service() -> FrameWebSocketService:
-        return FrameWebSocketService(RedisService())
+        return FrameWebSocketService(AsyncRedisService())
     
     
     @staticmethod
     def get_thumbnail_websocket_service() -> ThumbnailWebSocketService:
-        return ThumbnailWebSocketService(RedisService())
\ No newline at end of file
+        return ThumbnailWebSocketService(AsyncRedisService())
+    
+    
+    @staticmethod
+    def get_multi_stream_websocket_service() -> MultiStreamWebSocketService:
+        return MultiStreamWebSocketService(AsyncRedisService())
@@ -0,0 +1,250 @@
+from api.configs.logger import setup_logging
+setup_logging()
+import logging
+
+import json
+import time
+import uuid
+from typing import Dict, Any, List, Optional, Tuple
+
+import redis
+from django.db import close_old_connections, InterfaceError, OperationalError
+
+from api.configs.app import (
+    ALERT_STREAM_KEY,
+    ALERT_STREAM_GROUP,
+    ALERT_STREAM_MAXLEN,
+    ALERT_STREAM_BATCH_SIZE,
+    ALERT_STREAM_BLOCK_MS,
+    ALERT_STREAM_CLAIM_IDLE_MS,
+    ALERT_STREAM_MAX_DELIVERIES,
+    ALERT_STREAM_DEAD_LETTER_KEY,
+)
+from api.models import AlertData
+from api.services.postgres_db import (
+    build_alert,
+    cameras_for_alerts,
+    create_alerts_bulk,
+    IDEMPOTENCY_KEY_MAX_LENGTH,
+)
+
+
+# поле записи stream с тревогой в JSON
+ALERT_STREAM_FIELD = "alert"
+
+
+def _text(value) -> str:
+    return value.decode("utf-8") if isinstance(value, bytes) else value
+
+
+def enqueue_alert(redis_client: redis.Redis, alert_data: Dict[str, Any],
+                  idempotency_key: Optional[str] = None) -> Tuple[str, str]:
+    """
+    Добавляет тревогу в stream для записи воркером. Возвращает (idempotency_key, id записи).
+    Без ключа от клиента генерируется новый: тогда повтор запроса клиентом создаст вторую тревогу.
+    """
+    key = idempotency_key or uuid.uuid4().hex
+    payload = dict(alert_data, idempotency_key=key)
+    stream_id = redis_client.xadd(
+        ALERT_STREAM_KEY,
+        {ALERT_STREAM_FIELD: json.dumps(payload)},
+        maxlen=ALERT_STREAM_MAXLEN,
+        approximate=True,
+    )
+    return key, _text(stream_id)
+
+
+class AlertStreamWriter:
+    """
+    Воркер записи тревог из redis stream в бд (write-behind).
+
+    Читает stream в группе потребителей пачками до ALERT_STREAM_BATCH_SIZE и пишет
+    каждую пачку одним bulk_create. Записи подтверждаются (XACK) только после коммита,
+    поэтому при падении воркера или бд тревоги не теряются: неподтверждённые записи
+    через ALERT_STREAM_CLAIM_IDLE_MS забирает XAUTOCLAIM этот же или другой воркер.
+    Доставка не реже одного раза, а повторы отсекает уникальный idempotency_key:
+    тревоги с уже записанным ключом пропускаются.
+    Записи, которые нельзя превратить в тревогу (нет камеры, неверные данные),
+    логируются и подтверждаются, чтобы не возвращаться к ним бесконечно.
+
+    Если бд не принимает пачку из-за данных одной тревоги, пачка пишется по одной
+    записи: принятые подтверждаются, а запись, которая не записалась
+    ALERT_STREAM_MAX_DELIVERIES доставок подряд, переносится в
+    ALERT_STREAM_DEAD_LETTER_KEY и подтверждается. Недоступность бд
+    (OperationalError) так не обрабатывается: пачка остаётся неподтверждённой целиком.
+    """
+
+    def __init__(self, redis_client: redis.Redis, consumer_name: str,
+                 batch_size: int = ALERT_STREAM_BATCH_SIZE, block_ms: int = ALERT_STREAM_BLOCK_MS,
+                 claim_idle_ms: int = ALERT_STREAM_CLAIM_IDLE_MS,
+                 max_deliveries: int = ALERT_STREAM_MAX_DELIVERIES):
+        self.redis_client = redis_client
+        self.consumer_name = consumer_name
+        self.batch_size = batch_size
+        self.block_ms = block_ms
+        self.claim_idle_ms = claim_idle_ms
+        self.max_deliveries = max_deliveries
+        self._claim_cursor = "0-0"
+
+        self.written = 0
+        self.duplicates = 0
+        self.rejected = 0
+        self.dead_lettered = 0
+
+    def ensure_group(self):
+        try:
+            self.redis_client.xgroup_create(ALERT_STREAM_KEY, ALERT_STREAM_GROUP, id="0", mkstream=True)
+            logging.info(f"AlertStreamWriter: создана группа {ALERT_STREAM_GROUP} для {ALERT_STREAM_KEY}")
+        except redis.exceptions.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    def run(self, once: bool = False):
+        """Пишет тревоги, пока не прервут. once - остановиться, когда stream опустеет."""
+        self.ensure_group()
+        logging.info(f"AlertStreamWriter {self.consumer_name}: запуск, stream {ALERT_STREAM_KEY}")
+        while True:
+            try:
+                close_old_connections()
+                processed = self.process_batch(block=not once)
+                if once and not processed:
+                    break
+            except redis.exceptions.RedisError as e:
+                logging.error(f"AlertStreamWriter: ошибка redis: {e}")
+                time.sleep(self.block_ms / 1000)
+            except Exception as e:
+                # записи остались неподтверждёнными и будут перечитаны через XAUTOCLAIM
+                logging.error(f"AlertStreamWriter: ошибка записи пачки: {e}", exc_info=True)
+                time.sleep(self.block_ms / 1000)
+
+    def process_batch(self, block: bool = True) -> int:
+        """Забирает и записывает одну пачку. Возвращает число обработанных записей."""
+        entries = self._claim()
+        if not entries:
+            entries = self._read(block)
+        if not entries:
+            return 0
+
+        counters = (self.written, self.duplicates, self.rejected)
+        try:
+            self._write(entries)
+            done = entries
+        except (OperationalError, InterfaceError):
+            raise
+        except Exception as e:
+            self.written, self.duplicates, self.rejected = counters
+            logging.error(f"AlertStreamWriter: пачка из {len(entries)} записей не записана ({e}), запись по одной")
+            done = self._write_each(entries)
+
+        if done:
+            self.redis_client.xack(ALERT_STREAM_KEY, ALERT_STREAM_GROUP, *[entry_id for entry_id, _fields in done])
+        return len(entries)
+
+    def _write_each(self, entries: List[Tuple[Any, Optional[dict]]]) -> List[Tuple[Any, Optional[dict]]]:
+        """Пишет записи по одной. Возвращает записи, которые можно подтвердить."""
+        done = []
+        for entry in entries:
+            entry_id, fields = entry
+            try:
+                self._write([entry])
+                done.append(entry)
+            except (OperationalError, InterfaceError):
+                # бд недоступна: записанные уже не повторятся благодаря idempotency_key
+                raise
+            except Exception as e:
+                deliveries = self._deliveries(entry_id)
+                if deliveries >= self.max_deliveries:
+                    self._dead_letter(entry_id, fields, e)
+                    done.append(entry)
+                else:
+                    logging.error(f"AlertStreamWriter: запись {_text(entry_id)} не записана "
+                                  f"(доставка {deliveries} из {self.max_deliveries}): {e}")
+        return done
+
+    def _deliveries(self, entry_id) -> int:
+        """Сколько раз запись доставлялась воркерам группы (XPENDING)."""
+        pending = self.redis_client.xpending_range(
+            ALERT_STREAM_KEY, ALERT_STREAM_GROUP, min=entry_id, max=entry_id, count=1,
+        )
+        return pending[0]["times_delivered"] if pending else 0
+
+    def _dead_letter(self, entry_id, fields: dict, error: Exception):
+        self.redis_client.xadd(
+            ALERT_STREAM_DEAD_LETTER_KEY,
+            dict(fields, entry_id=_text(entry_id), error=str(error)),
+            maxlen=ALERT_STREAM_MAXLEN,
+            approximate=True,
+        )
+        self.dead_lettered += 1
+        logging.error(f"AlertStreamWriter: запись {_text(entry_id)} перенесена в {ALERT_STREAM_DEAD_LETTER_KEY}: {error}")
+
+    def _claim(self) -> List[Tuple[Any, Optional[dict]]]:
+        """Записи, которые слишком долго остаются неподтверждёнными у упавших воркеров (или у этого)."""
+        result = self.redis_client.xautoclaim(
+            ALERT_STREAM_KEY, ALERT_STREAM_GROUP, self.consumer_name,
+            min_idle_time=self.claim_idle_ms, start_id=self._claim_cursor, count=self.batch_size,
+        )
+        self._claim_cursor, entries = _text(result[0]), result[1]
+        if entries:
+            logging.warning(f"AlertStreamWriter {self.consumer_name}: повторная обработка {len(entries)} записей")
+        return entries
+
+    def _read(self, block: bool) -> List[Tuple[Any, Optional[dict]]]:
+        response = self.redis_client.xreadgroup(
+            ALERT_STREAM_GROUP, self.consumer_name, {ALERT_STREAM_KEY: ">"},
+            count=self.batch_size, block=self.block_ms if block else None,
+        )
+        return response[0][1] if response else []
+
+    def _write(self, entries: List[Tuple[Any, Optional[dict]]]):
+        # повторы одной тревоги внутри пачки сводятся к одной записи
+        payloads: Dict[str, dict] = {}
+        for entry_id, fields in entries:
+            payload = self._parse(entry_id, fields)
+            if payload is not None:
+                payloads.setdefault(payload["idempotency_key"], payload)
+
+        existing = set(AlertData.objects.filter(idempotency_key__in=list(payloads))
+                       .values_list("idempotency_key", flat=True))
+        cameras = cameras_for_alerts(payloads.values())
+
+        alerts = []
+        for key, payload in payloads.items():
+            if key in existing:
+                self.duplicates += 1
+                continue
+            alert, error = build_alert(payload, cameras)
+            if error:
+                self.rejected += 1
+                logging.error(f"AlertStreamWriter: тревога {key} отклонена: {error}")
+                continue
+            alerts.append(alert)
+
+        if alerts:
+            # ключ мог записать параллельный воркер между проверкой и вставкой
+            create_alerts_bulk(alerts, ignore_conflicts=True)
+            self.written += len(alerts)
+        logging.info(f"AlertStreamWriter {self.consumer_name}: записано {len(alerts)} из {len(entries)}, "
+                     f"всего записано {self.written}, повторов {self.duplicates}, отклонено {self.rejected}, "
+                     f"в {ALERT_STREAM_DEAD_LETTER_KEY} {self.dead_lettered}")
+
+    def _parse(self, entry_id, fields: Optional[dict]) -> Optional[dict]:
+        if not fields:
+            # запись удалена из stream (MAXLEN) до того, как её забрали
+            self.rejected += 1
+            logging.error(f"AlertStreamWriter: запись {_text(entry_id)} удалена из stream")
+            return None
+        raw = fields.get(ALERT_STREAM_FIELD.encode()) or fields.get(ALERT_STREAM_FIELD)
+        try:
+            payload = json.loads(raw)
+        except (TypeError, ValueError):
+            self.rejected += 1
+            logging.error(f"AlertStreamWriter: запись {_text(entry_id)} не содержит тревогу в JSON")
+            return None
+        key = payload.get("idempotency_key") if isinstance(payload, dict) else None
+        if not key or len(str(key)) > IDEMPOTENCY_KEY_MAX_LENGTH:
+            self.rejected += 1
+            logging.error(f"AlertStreamWriter: запись {_text(entry_id)} без допустимого idempotency_key")
+            return None
+        payload["idempotency_key"] = str(key)
+        return payload
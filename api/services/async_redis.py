@@ -0,0 +1,36 @@
+from api.configs.logger import setup_logging
+import logging
+import redis
+import redis.asyncio as aioredis
+from api.configs.app import async_redis_client
+setup_logging()
+from api.metaclasses.singletone import Singletone
+
+
+class AsyncRedisService(metaclass=Singletone):
+    """
+    Асинхронный клиент redis.asyncio со своим пулом соединений для общего опросчика
+    websocket сервисов (RedisPollerHub), чтобы ожидание ответа redis не блокировало event loop.
+    """
+
+    def __init__(self):
+        self.redis_client = async_redis_client
+        logging.info(f"инициализация AsyncRedisService")
+
+
+    def get_redis_client(self) -> aioredis.Redis:
+        return self.redis_client
+
+
+    async def get_many_raw(self, keys):
+        """Читает несколько ключей одним MGET, возвращает сырые байты в том же порядке."""
+        if not keys:
+            return []
+        try:
+            return await self.redis_client.mget(keys)
+        except (AttributeError, TypeError) as e:
+            logging.error(f"Redis configuration error: {str(e)}")
+            return [None] * len(keys)
+        except redis.exceptions.RedisError as e:
+            logging.error(f"Redis error: {str(e)}")
+            return [None] * len(keys)
@@ -0,0 +1,227 @@
+from api.configs.logger import setup_logging
+setup_logging()
+import logging
+
+import os
+import time
+import uuid
+import socket
+import asyncio
+from typing import Dict, Any, Optional, Set, Tuple
+
+from channels.layers import get_channel_layer
+from redis.exceptions import NoScriptError
+
+from api.configs.app import (
+    WEBSOCKET_FANOUT_ELECTION_INTERVAL,
+    WEBSOCKET_FANOUT_LEADER_TTL,
+    WEBSOCKET_FANOUT_LOCK_PREFIX,
+)
+from api.metaclasses.singletone import Singletone
+from api.services.redis import DATA_KEY_PREFIXES
+
+
+# захватить свободное лидерство или продлить своё
+ACQUIRE_LEADER_SCRIPT = """
+local owner = redis.call('GET', KEYS[1])
+if not owner then
+    redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+    return 1
+end
+if owner == ARGV[1] then
+    redis.call('PEXPIRE', KEYS[1], ARGV[2])
+    return 1
+end
+return 0
+"""
+
+# отдать лидерство, только если оно ещё наше
+RELEASE_LEADER_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def camera_group_name(kind: str, camera_id) -> str:
+    """Группа channel layer, в которую публикуются данные камеры: camera.<id>.<вид данных>."""
+    return f"camera.{camera_id}.{kind}"
+
+
+class ChannelLayerFanout(metaclass=Singletone):
+    """
+    Раздача данных камер между процессами daphne через channel layer (channels_redis).
+
+    Каждый процесс хочет получать камеры, на которые подписаны его клиенты. По каждой
+    такой камере процессы соревнуются за лидерство (ключ в redis с TTL): лидер опрашивает
+    камеру общим опросчиком своего процесса и публикует каждое новое значение в группу
+    camera.<id>.<вид данных>. В группах состоит не каждый клиент, а один канал процесса
+    (sync_groups): значение камеры доходит до процесса одной копией, передаётся в
+    RedisPollerHub (ingest) один раз, дальше всё как обычно. Redis по камере опрашивает
+    один процесс, а трафик channel layer растёт с числом камер × процессов, а не клиентов.
+
+    Лидер продлевает лидерство каждые WEBSOCKET_FANOUT_ELECTION_INTERVAL секунд. Когда у
+    лидера не остаётся клиентов камеры, он отдаёт лидерство, а если процесс упал - оно
+    истекает через WEBSOCKET_FANOUT_LEADER_TTL и его забирает другой процесс.
+    """
+
+    def __init__(self, hub=None, redis_service=None):
+        self._hub = hub
+        self._redis_service = redis_service
+        self._worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        # ключи (вид данных, camera_id), по которым этот процесс - лидер
+        self._leading: Set[Tuple[str, Any]] = set()
+        # версия данных ключа, опубликованная последней
+        self._published: Dict[Tuple[str, Any], int] = {}
+        # канал процесса в channel layer и группы камер, в которых он состоит
+        self._channel: Optional[str] = None
+        self._groups: Set[Tuple[str, Any]] = set()
+        self._groups_refreshed_at = 0.0
+        self._groups_lock: Optional[asyncio.Lock] = None
+        # скрипты выборов отправляются по sha (EVALSHA), текст Lua - только при загрузке
+        self._acquire_script = None
+        self._release_script = None
+        self._election_task: Optional[asyncio.Task] = None
+        self._publish_task: Optional[asyncio.Task] = None
+        self._receive_task: Optional[asyncio.Task] = None
+        logging.info(f"ChannelLayerFanout инициализирован, процесс: {self._worker_id}")
+
+    def start(self):
+        if self._election_task is None or self._election_task.done():
+            self._election_task = asyncio.create_task(self._election_loop())
+        if self._publish_task is None or self._publish_task.done():
+            self._publish_task = asyncio.create_task(self._publish_loop())
+        if self._receive_task is None or self._receive_task.done():
+            self._receive_task = asyncio.create_task(self._receive_loop())
+
+    async def sync_groups(self):
+        """
+        Приводит группы, в которых состоит канал процесса, к ключам с подписчиками в процессе.
+        Вызывается после изменения подписок клиентов и периодически из цикла выборов.
+        """
+        if self._groups_lock is None:
+            self._groups_lock = asyncio.Lock()
+        async with self._groups_lock:
+            channel_layer = get_channel_layer()
+            if self._channel is None:
+                self._channel = await channel_layer.new_channel()
+            wanted = set(self._hub.subscribed_keys())
+
+            # channels_redis забывает участников группы через group_expiry, поэтому членство продлевается
+            if time.monotonic() - self._groups_refreshed_at > getattr(channel_layer, "group_expiry", 86400) / 2:
+                self._groups_refreshed_at = time.monotonic()
+                added = wanted
+            else:
+                added = wanted - self._groups
+
+            for kind, camera_id in added:
+                await channel_layer.group_add(camera_group_name(kind, camera_id), self._channel)
+            for kind, camera_id in self._groups - wanted:
+                await channel_layer.group_discard(camera_group_name(kind, camera_id), self._channel)
+            self._groups = wanted
+
+    @staticmethod
+    def _lock_key(key: Tuple[str, Any]) -> str:
+        kind, camera_id = key
+        return f"{WEBSOCKET_FANOUT_LOCK_PREFIX}{DATA_KEY_PREFIXES[kind]}{camera_id}"
+
+    async def _election_loop(self):
+        while True:
+            try:
+                await self._elect()
+                await self.sync_groups()
+                await asyncio.sleep(WEBSOCKET_FANOUT_ELECTION_INTERVAL)
+            except asyncio.CancelledError:
+                logging.info("ChannelLayerFanout: выборы лидеров остановлены")
+                break
+            except Exception as e:
+                logging.error(f"ChannelLayerFanout: ошибка выборов лидеров: {e}")
+                await asyncio.sleep(WEBSOCKET_FANOUT_ELECTION_INTERVAL)
+
+    async def _elect(self):
+        """Продлевает или захватывает лидерство по нужным ключам и отдаёт ненужные."""
+        client = self._redis_service.get_redis_client()
+        wanted = self._hub.subscribed_keys()
+        released = self._leading - set(wanted)
+        ttl_ms = int(WEBSOCKET_FANOUT_LEADER_TTL * 1000)
+
+        if self._acquire_script is None:
+            self._acquire_script = client.register_script(ACQUIRE_LEADER_SCRIPT)
+            self._release_script = client.register_script(RELEASE_LEADER_SCRIPT)
+
+        try:
+            results = await self._run_election(client, wanted, released, ttl_ms)
+        except NoScriptError:
+            # redis перезапущен или скрипты сброшены - загружаем заново и повторяем
+            await client.script_load(ACQUIRE_LEADER_SCRIPT)
+            await client.script_load(RELEASE_LEADER_SCRIPT)
+            results = await self._run_election(client, wanted, released, ttl_ms)
+
+        leading = {key for key, result in zip(wanted, results) if result == 1}
+        for key in leading - self._leading:
+            logging.info(f"ChannelLayerFanout: процесс стал лидером по {key}")
+            self._hub.set_remote(*key, remote=False)
+        for key in self._leading - leading:
+            self._hub.set_remote(*key, remote=True)
+            self._published.pop(key, None)
+        self._leading = leading
+
+    async def _run_election(self, client, wanted, released, ttl_ms: int) -> list:
+        # все ключи одним round trip
+        async with client.pipeline(transaction=False) as pipe:
+            for key in wanted:
+                pipe.evalsha(self._acquire_script.sha, 1, self._lock_key(key), self._worker_id, ttl_ms)
+            for key in released:
+                pipe.evalsha(self._release_script.sha, 1, self._lock_key(key), self._worker_id)
+            return await pipe.execute()
+
+    async def _receive_loop(self):
+        """Получает данные камер, опубликованные лидерами, и передаёт их в опросчик процесса."""
+        channel_layer = get_channel_layer()
+        while True:
+            try:
+                if self._channel is None:
+                    await self.sync_groups()
+                message = await channel_layer.receive(self._channel)
+                if message.get("type") == "camera.data":
+                    await self._hub.ingest(message["kind"], message["camera_id"], message["raw"], message["updated_at"])
+            except asyncio.CancelledError:
+                logging.info("ChannelLayerFanout: получение данных остановлено")
+                break
+            except Exception as e:
+                logging.error(f"ChannelLayerFanout: ошибка получения данных: {e}")
+                await asyncio.sleep(WEBSOCKET_FANOUT_ELECTION_INTERVAL)
+
+    async def _publish_loop(self):
+        channel_layer = get_channel_layer()
+        last_tick = self._hub.tick
+
+        while True:
+            try:
+                last_tick = await self._hub.wait_for_tick(last_tick)
+
+                for key in list(self._leading):
+                    version, updated_at = self._hub.get_meta(*key)
+                    if not version or self._published.get(key) == version:
+                        continue
+                    self._published[key] = version
+
+                    raw = self._hub.get_raw(*key)
+                    if raw is None:
+                        continue
+                    kind, camera_id = key
+                    await channel_layer.group_send(camera_group_name(kind, camera_id), {
+                        "type": "camera.data",
+                        "kind": kind,
+                        "camera_id": camera_id,
+                        "raw": raw,
+                        "updated_at": updated_at or time.time(),
+                    })
+
+            except asyncio.CancelledError:
+                logging.info("ChannelLayerFanout: публикация остановлена")
+                break
+            except Exception as e:
+                logging.error(f"ChannelLayerFanout: ошибка публикации: {e}")
+                await asyncio.sleep(WEBSOCKET_FANOUT_ELECTION_INTERVAL)
@@ -0,0 +1,39 @@
+import zlib
+
+from api.configs.app import WEBSOCKET_COMPRESSION_LEVEL
+
+
+# Сжатие текстовых сообщений websocket на уровне приложения.
+# Daphne не поддерживает расширение permessage-deflate, поэтому сжатие согласуется
+# в первом сообщении клиента: {"camera_list": [...], "compression": "deflate"},
+# сервер подтверждает текстовым сообщением {"compression": "deflate"}.
+# Дальше JSON сообщения сжатых видов данных приходят бинарными сообщениями:
+#   маркер 1 байт (0, у сообщений бинарного протокола первый байт - версия протокола)
+#   далее raw deflate (RFC 1951) с Z_SYNC_FLUSH, заканчивается на 00 00 ff ff.
+# Контекст сжатия общий для всего соединения, как в permessage-deflate с context takeover:
+# клиент держит один raw inflate на соединение и распаковывает сообщения по порядку
+# (например, pako.Inflate({raw: true}).push(data.subarray(1), pako.constants.Z_SYNC_FLUSH)).
+# Мелкие сообщения уходят текстом без сжатия и в контекст не попадают.
+
+COMPRESSION_DEFLATE = "deflate"
+COMPRESSED_MESSAGE_MARKER = b"\x00"
+
+
+class DeflateCompressor:
+    """Сжатие сообщений одного соединения с сохранением словаря между сообщениями."""
+
+    def __init__(self, level: int = WEBSOCKET_COMPRESSION_LEVEL):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        self.raw_bytes = 0
+        self.compressed_bytes = 0
+
+    def compress(self, message: str) -> bytes:
+        data = message.encode("utf-8")
+        compressed = self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        self.raw_bytes += len(data)
+        self.compressed_bytes += len(compressed)
+        return COMPRESSED_MESSAGE_MARKER + compressed
+
+    @property
+    def ratio(self) -> float:
+        return self.compressed_bytes / self.raw_bytes if self.raw_bytes else 1.0
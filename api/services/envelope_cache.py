@@ -0,0 +1,61 @@
+from api.configs.logger import setup_logging
+setup_logging()
+import logging
+
+from collections import OrderedDict
+from typing import Dict, Any, Callable, Optional, Tuple
+
+from api.configs.app import WEBSOCKET_ENVELOPE_CACHE_SIZE
+from api.metaclasses.singletone import Singletone
+
+
+class EnvelopeCache(metaclass=Singletone):
+    """
+    Общий кэш готовых текстовых сообщений {"data": {...}} для всех websocket клиентов процесса.
+
+    Клиенты, подписанные на одни и те же камеры, на каждом тике отправляют одинаковые
+    данные. Сообщение собирается один раз на (вид данных, набор камер, версии данных
+    камер), остальные клиенты получают тот же объект строки. Для набора камер хранится
+    только последняя собранная версия: когда данные камер обновляются, запись заменяется.
+    Наборы камер, которые давно никто не отправлял, вытесняются при превышении
+    WEBSOCKET_ENVELOPE_CACHE_SIZE.
+
+    Бинарные сообщения кэшировать здесь не нужно: они и так упаковываются один раз на
+    версию данных камеры в общем опросчике (get_image_message).
+    """
+
+    def __init__(self, max_entries: int = WEBSOCKET_ENVELOPE_CACHE_SIZE):
+        self._max_entries = max(1, max_entries)
+        # (вид данных, вид в конверте, камеры) -> (версии данных камер, сообщение)
+        self._entries: "OrderedDict[Tuple, Tuple[Tuple, str]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        logging.info(f"EnvelopeCache инициализирован, размер: {self._max_entries}")
+
+    def get(self, kind: str, message_kind: Optional[str], versions: Tuple, build: Callable[[], str]) -> str:
+        """
+        Сообщение для камер с данными указанных версий.
+        versions - ((camera_id, вид данных в redis, версия), ...) в порядке камер в сообщении.
+        """
+        key = (kind, message_kind, tuple(camera_id for camera_id, _source_kind, _version in versions))
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == versions:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+        message = build()
+        # запись с устаревшими версиями заменяется новой
+        self._entries[key] = (versions, message)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+        self.misses += 1
+        return message
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+        }
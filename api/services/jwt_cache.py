@@ -0,0 +1,103 @@
+from api.configs.logger import setup_logging
+setup_logging()
+import logging
+
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Any
+
+from rest_framework_simplejwt.tokens import AccessToken, TokenError
+
+from api.configs.app import JWT_VERIFICATION_CACHE_SIZE
+from api.metaclasses.singletone import Singletone
+
+
+class VerifiedTokenCache(metaclass=Singletone):
+    """
+    Кэш проверенных JWT access токенов процесса.
+
+    Проверка подписи и разбор токена выполняются один раз, дальше до истечения exp
+    токен берётся из кэша по sha256 от строки токена. Когда дашборд разом переподключает
+    десятки сокетов с одним cookie, токен проверяется один раз. Недействительные токены
+    не кэшируются. Кэш ограничен JWT_VERIFICATION_CACHE_SIZE, вытесняются давно не
+    использованные токены.
+
+    При выходе из системы access токен отзывается (revoke) и до своего exp не принимается
+    этим процессом, даже если подпись верна. Отзыв действует только в процессе, где
+    выполнен выход: в остальных процессах токен живёт до exp, как и без кэша.
+    Обращения идут из event loop и из потоков синхронных view, поэтому кэш под блокировкой.
+    """
+
+    def __init__(self, max_entries: int = JWT_VERIFICATION_CACHE_SIZE):
+        self._max_entries = max(1, max_entries)
+        self._lock = threading.Lock()
+        # хэш токена -> проверенный токен
+        self._tokens: "OrderedDict[str, AccessToken]" = OrderedDict()
+        # хэш отозванного токена -> exp
+        self._revoked: Dict[str, float] = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(token: str) -> str:
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+    def validate(self, token: str) -> AccessToken:
+        """Проверенный access токен. TokenError, если токен недействителен, истёк или отозван."""
+        key = self._key(token)
+        now = time.time()
+        with self._lock:
+            if key in self._revoked:
+                raise TokenError("Token is revoked")
+            cached = self._tokens.get(key)
+            if cached is not None:
+                if cached["exp"] > now:
+                    self._tokens.move_to_end(key)
+                    self.hits += 1
+                    return cached
+                del self._tokens[key]
+
+        validated = AccessToken(token)
+        with self._lock:
+            self.misses += 1
+            self._tokens[key] = validated
+            if len(self._tokens) > self._max_entries:
+                self._evict(now)
+        return validated
+
+    def revoke(self, token: str):
+        """Убирает токен из кэша и больше не принимает его до истечения exp."""
+        key = self._key(token)
+        try:
+            exp = AccessToken(token)["exp"]
+        except TokenError:
+            # недействительный токен и так не пройдёт проверку
+            exp = None
+        with self._lock:
+            self._tokens.pop(key, None)
+            if exp is not None:
+                self._revoked[key] = exp
+            self._purge_revoked(time.time())
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            'entries': len(self._tokens),
+            'revoked': len(self._revoked),
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+    def _evict(self, now: float):
+        expired = [key for key, token in self._tokens.items() if token["exp"] <= now]
+        for key in expired:
+            del self._tokens[key]
+        while len(self._tokens) > self._max_entries:
+            self._tokens.popitem(last=False)
+        if expired:
+            logging.debug(f"VerifiedTokenCache: удалено истёкших токенов: {len(expired)}")
+
+    def _purge_revoked(self, now: float):
+        for key in [key for key, exp in self._revoked.items() if exp <= now]:
+            del self._revoked[key]
@@ -0,0 +1,128 @@
+from api.configs.logger import setup_logging
+setup_logging()
+import logging
+
+import time
+import asyncio
+from typing import Dict, Any, Optional, Set
+
+from api.configs.app import WEBSOCKET_REAPER_TICK
+from api.metaclasses.singletone import Singletone
+
+
+class ClientLivenessMonitor(metaclass=Singletone):
+    """
+    Общий на процесс монитор активности websocket клиентов всех сервисов.
+
+    Клиенты разложены по ячейкам колеса таймеров по сроку неактивности
+    (время последнего сообщения + inactive_timeout клиента). Сообщение клиента только
+    обновляет время последней активности, ячейки при этом не трогаются. Раз в
+    WEBSOCKET_REAPER_TICK секунд проверяются только клиенты наступивших ячеек: кто
+    успел прислать сообщение, переносится в ячейку нового срока, остальные закрываются
+    вместе с задачей отправки и подписками. Стоимость проверки зависит от числа
+    клиентов с наступившим сроком, а не от числа всех подключений.
+    """
+
+    def __init__(self):
+        self._tick = WEBSOCKET_REAPER_TICK
+        # client_id -> подключение и время его последнего сообщения
+        self._connections: Dict[int, Any] = {}
+        self._last_seen: Dict[int, float] = {}
+        # номер ячейки -> client_id клиентов, срок которых в ней наступает
+        self._wheel: Dict[int, Set[int]] = {}
+        self._cursor: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+
+        self.reaped_total = 0
+        self.reaped_by_service: Dict[str, int] = {}
+        logging.info("ClientLivenessMonitor инициализирован")
+
+    def register(self, connection):
+        """
+        Начинает следить за клиентом. У подключения должны быть client_id, inactive_timeout и reap().
+        Повторная регистрация только обновляет время активности.
+        """
+        now = time.monotonic()
+        client_id = connection.client_id
+        if client_id in self._connections:
+            self._last_seen[client_id] = now
+            return
+        self._connections[client_id] = connection
+        self._last_seen[client_id] = now
+        self._schedule(client_id, now + connection.inactive_timeout)
+        self._ensure_started()
+
+    def touch(self, connection):
+        """Клиент прислал сообщение."""
+        if connection.client_id in self._last_seen:
+            self._last_seen[connection.client_id] = time.monotonic()
+
+    def unregister(self, connection):
+        # запись в колесе остаётся и пропускается, когда до неё дойдёт очередь
+        self._connections.pop(connection.client_id, None)
+        self._last_seen.pop(connection.client_id, None)
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            'clients': len(self._connections),
+            'reaped_total': self.reaped_total,
+            'reaped_by_service': dict(self.reaped_by_service),
+        }
+
+    def _slot(self, deadline: float) -> int:
+        # ячейка, к началу которой срок уже наступил
+        return int(deadline // self._tick) + 1
+
+    def _schedule(self, client_id: int, deadline: float):
+        slot = self._slot(deadline)
+        if self._cursor is not None and slot <= self._cursor:
+            slot = self._cursor + 1
+        self._wheel.setdefault(slot, set()).add(client_id)
+
+    def _ensure_started(self):
+        if self._task is None or self._task.done():
+            self._cursor = int(time.monotonic() // self._tick)
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.sleep(self._tick)
+                now = time.monotonic()
+                current = int(now // self._tick)
+                reaped: Dict[str, int] = {}
+
+                while self._cursor <= current:
+                    for client_id in self._wheel.pop(self._cursor, ()):
+                        connection = self._connections.get(client_id)
+                        if connection is None:
+                            continue
+                        deadline = self._last_seen[client_id] + connection.inactive_timeout
+                        if deadline > now:
+                            self._schedule(client_id, deadline)
+                            continue
+                        await self._reap(client_id, connection)
+                        reaped[connection.name] = reaped.get(connection.name, 0) + 1
+                    self._cursor += 1
+
+                if reaped:
+                    logging.info(
+                        f"ClientLivenessMonitor: закрыто неактивных клиентов: {sum(reaped.values())} {reaped}. "
+                        f"Всего закрыто: {self.reaped_total}, подключений: {len(self._connections)}"
+                    )
+
+            except asyncio.CancelledError:
+                logging.info("ClientLivenessMonitor остановлен")
+                break
+            except Exception as e:
+                logging.error(f"ClientLivenessMonitor: ошибка проверки клиентов: {e}")
+
+    async def _reap(self, client_id: int, connection):
+        self._connections.pop(client_id, None)
+        self._last_seen.pop(client_id, None)
+        self.reaped_total += 1
+        self.reaped_by_service[connection.name] = self.reaped_by_service.get(connection.name, 0) + 1
+        try:
+            await connection.reap()
+        except Exception as e:
+            logging.warning(f"ClientLivenessMonitor: ошибка при закрытии клиента {client_id}: {e}")
@@ -0,0 +1,44 @@
+from typing import Any, Dict, Optional
+
+
+class _Unrepresentable(Exception):
+    pass
+
+
+def merge_patch_diff(old: Dict[str, Any], new: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    JSON merge patch (RFC 7386), который переводит old в new: изменённые поля,
+    null для удалённых, вложенные объекты - своими патчами, списки - целиком.
+    Пустой словарь, если изменений нет. None, если разницу патчем выразить нельзя:
+    null в patch означает удаление, поэтому новое значение null не передаётся.
+    """
+    try:
+        return _diff(old, new)
+    except _Unrepresentable:
+        return None
+
+
+def _diff(old: Dict[str, Any], new: Dict[str, Any]) -> Dict[str, Any]:
+    patch = {}
+    for key in old:
+        if key not in new:
+            patch[key] = None
+    for key, value in new.items():
+        if key not in old:
+            patch[key] = _checked(value)
+        elif old[key] == value:
+            continue
+        elif isinstance(value, dict) and isinstance(old[key], dict):
+            patch[key] = _diff(old[key], value)
+        else:
+            patch[key] = _checked(value)
+    return patch
+
+
+def _checked(value):
+    if value is None:
+        raise _Unrepresentable()
+    if isinstance(value, dict):
+        for item in value.values():
+            _checked(item)
+    return value
@@ -0,0 +1,169 @@
+from api.configs.logger import setup_logging
+setup_logging()
+import logging
+
+import io
+import math
+import time
+import base64
+import asyncio
+from typing import Dict, Any, Optional, Tuple, List
+
+try:
+    from PIL import Image
+except ImportError:
+    # Pillow - необязательная зависимость, без него режим мозаики недоступен
+    Image = None
+
+from api.configs.app import (
+    WEBSOCKET_MOSAIC_TILE_SIZE,
+    WEBSOCKET_MOSAIC_QUALITY,
+    WEBSOCKET_MOSAIC_COLUMNS,
+    WEBSOCKET_MOSAIC_TTL,
+)
+from api.metaclasses.singletone import Singletone
+from api.services.binary_protocol import decode_image, pack_image_message
+
+
+MOSAIC_KIND = "mosaic"
+
+
+def mosaic_layout(camera_ids) -> Dict[str, Any]:
+    """Раскладка мозаики: камеры по порядку слева направо, сверху вниз."""
+    count = len(camera_ids)
+    columns = WEBSOCKET_MOSAIC_COLUMNS or max(1, math.ceil(math.sqrt(count)))
+    return {
+        "cameras": list(camera_ids),
+        "columns": columns,
+        "rows": max(1, math.ceil(count / columns)),
+        "tile_size": list(WEBSOCKET_MOSAIC_TILE_SIZE),
+    }
+
+
+class MosaicBuilder(metaclass=Singletone):
+    """
+    Собирает из последних миниатюр камер (only_thumbnail_data_*) одну JPEG сетку.
+
+    Мозаика для набора камер собирается один раз на обновление их миниатюр и общая
+    для всех клиентов с тем же набором: клиенты, пришедшие за ней во время сборки,
+    ждут ту же сборку. Декодирование и уменьшение миниатюры выполняется один раз на
+    её версию, сборка и кодирование JPEG - в пуле потоков, чтобы не блокировать event loop.
+    Готовая мозаика хранится сразу в виде бинарного сообщения и тела JSON конверта.
+    """
+
+    def __init__(self, hub=None):
+        self._hub = hub
+        # набор камер -> собранная мозаика
+        self._entries: Dict[Tuple, Dict[str, Any]] = {}
+        # набор камер -> идущая сборка
+        self._building: Dict[Tuple, asyncio.Task] = {}
+        # camera_id -> (версия миниатюры, уменьшенное изображение)
+        self._tiles: Dict[Any, Tuple[int, Any]] = {}
+        self._seq = 0
+
+    @staticmethod
+    def is_available() -> bool:
+        return Image is not None
+
+    async def get(self, camera_ids) -> Optional[Dict[str, Any]]:
+        """
+        Мозаика из последних миниатюр камер: {"layout", "binary", "body", "versions"}
+        или None, если ни одной миниатюры ещё нет.
+        """
+        key = tuple(camera_ids)
+        versions = tuple(self._hub.get_version("thumbnail", camera_id) for camera_id in key)
+        self._prune()
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry["accessed_at"] = time.monotonic()
+            if entry["versions"] == versions:
+                return entry
+
+        entry = await self._join_build(key)
+        if entry is not None and entry["versions"] != versions:
+            # идущая сборка начата по более старым миниатюрам - нужна ещё одна
+            entry = await self._join_build(key)
+        return entry
+
+    async def _join_build(self, key: Tuple) -> Optional[Dict[str, Any]]:
+        """Ждёт идущую сборку мозаики камер key или начинает новую."""
+        task = self._building.get(key)
+        if task is None:
+            task = asyncio.create_task(self._build(key))
+            self._building[key] = task
+            task.add_done_callback(lambda _task: self._building.pop(key, None))
+        # отмена ожидающего клиента не должна отменять общую сборку
+        return await asyncio.shield(task)
+
+    async def _build(self, key: Tuple) -> Optional[Dict[str, Any]]:
+        # версии и JPEG миниатюр берутся в один момент, чтобы версии мозаики совпадали с её содержимым.
+        # JPEG достаются из общего кэша опросчика: base64 декодируется один раз на версию
+        versions = tuple(self._hub.get_version("thumbnail", camera_id) for camera_id in key)
+        jpegs = [self._hub.get_derived("thumbnail", camera_id, "jpeg", decode_image) for camera_id in key]
+        if not any(jpegs):
+            return None
+
+        layout = mosaic_layout(key)
+        try:
+            image = await asyncio.to_thread(self._compose, key, versions, jpegs, layout)
+        except Exception as e:
+            logging.error(f"MosaicBuilder: ошибка сборки мозаики камер {list(key)}: {e}")
+            return None
+
+        self._seq += 1
+        now = time.time()
+        entry = {
+            "layout": layout,
+            "versions": versions,
+            "binary": pack_image_message(MOSAIC_KIND, 0, self._seq, now, image),
+            "body": b'"mosaic": "' + base64.b64encode(image) + b'"',
+            "accessed_at": time.monotonic(),
+        }
+        self._entries[key] = entry
+        return entry
+
+    def _compose(self, key: Tuple, versions: Tuple, jpegs: List[Optional[bytes]], layout: Dict[str, Any]) -> bytes:
+        tile_width, tile_height = WEBSOCKET_MOSAIC_TILE_SIZE
+        columns = layout["columns"]
+        canvas = Image.new("RGB", (columns * tile_width, layout["rows"] * tile_height))
+
+        for index, (camera_id, version, jpeg) in enumerate(zip(key, versions, jpegs)):
+            tile = self._tile(camera_id, version, jpeg)
+            if tile is None:
+                continue
+            # уменьшенная с сохранением пропорций миниатюра - по центру своей клетки
+            x = (index % columns) * tile_width + (tile_width - tile.width) // 2
+            y = (index // columns) * tile_height + (tile_height - tile.height) // 2
+            canvas.paste(tile, (x, y))
+
+        buffer = io.BytesIO()
+        canvas.save(buffer, "JPEG", quality=WEBSOCKET_MOSAIC_QUALITY)
+        return buffer.getvalue()
+
+    def _tile(self, camera_id, version: int, jpeg: Optional[bytes]):
+        cached = self._tiles.get(camera_id)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        if not jpeg:
+            return None
+
+        image = Image.open(io.BytesIO(jpeg))
+        # декодер JPEG сразу уменьшает изображение в 2/4/8 раз, если это возможно
+        image.draft("RGB", WEBSOCKET_MOSAIC_TILE_SIZE)
+        image = image.convert("RGB")
+        image.thumbnail(WEBSOCKET_MOSAIC_TILE_SIZE)
+        self._tiles[camera_id] = (version, image)
+        return image
+
+    def _prune(self):
+        """Удаляет мозаики, которые давно никто не запрашивал, и миниатюры, которые им больше не нужны."""
+        deadline = time.monotonic() - WEBSOCKET_MOSAIC_TTL
+        stale = [key for key, entry in self._entries.items() if entry["accessed_at"] < deadline]
+        if not stale:
+            return
+        for key in stale:
+            del self._entries[key]
+        used = {camera_id for key in list(self._entries) + list(self._building) for camera_id in key}
+        for camera_id in [camera_id for camera_id in list(self._tiles) if camera_id not in used]:
+            del self._tiles[camera_id]
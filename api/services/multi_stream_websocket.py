@@ -0,0 +1,17 @@
+from typing import Dict, Any
+
+from api.services.streaming_websocket import StreamingWebSocketService
+
+
+class MultiStreamWebSocketService(StreamingWebSocketService):
+    """
+    Сервис раздачи нескольких видов данных по одному соединению: кадры, миниатюры,
+    алерты и полные данные. Клиент выбирает камеры для каждого вида данных:
+    {"streams": {"frame": [1], "thumbnail": [1, 2, 3], "alert": [1, 2, 3]}}.
+    Подключение, аутентификация через access_token в cookies и отправка данных -
+    в StreamingWebSocketService.
+    """
+
+    kinds = ("full", "frame", "alert", "thumbnail")
+    name = "MultiStreamWebSocket"
+    _clients: Dict[int, Dict[str, Any]] = {}
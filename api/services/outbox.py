@@ -0,0 +1,151 @@
+from api.configs.logger import setup_logging
+setup_logging()
+import logging
+
+import time
+import asyncio
+from typing import Dict, Any, Optional, Callable, Awaitable
+
+
+class LatestWinsOutbox:
+    """
+    Очередь отправки одного websocket клиента, ограниченная одним элементом на камеру.
+
+    Пока отправка предыдущей пачки не закончилась, новые данные камеры не встают
+    в очередь, а заменяют ещё не отправленные данные этой же камеры (latest wins).
+    Отправитель забирает сразу все ожидающие камеры и передаёт их в flush, который
+    собирает и отправляет сообщения и возвращает их количество.
+
+    ASGI send не даёт обратного давления (Daphne буферизует без ограничений), поэтому
+    клиент может включить подтверждения: {"type": "ack"} на каждое полученное
+    сообщение. Тогда в полёте одновременно не больше max_in_flight сообщений, а
+    медленный клиент получает только самые свежие данные и не раздувает буферы сервера.
+    """
+
+    def __init__(self, flush: Callable[[Dict[Any, Any]], Awaitable[int]], name: str = ""):
+        self._flush = flush
+        self._name = name
+        self._pending: Dict[Any, Any] = {}
+        self._enqueued_at: Dict[Any, float] = {}
+        self._wakeup = asyncio.Event()
+        self._credit = asyncio.Event()
+        self._credit.set()
+        self._task: Optional[asyncio.Task] = None
+
+        self.max_in_flight: Optional[int] = None
+        self.in_flight = 0
+
+        self.sent_messages = 0
+        self.dropped = 0
+        self.lag_total = 0.0
+        self.lag_max = 0.0
+        self.lag_count = 0
+        # задержка с последнего take_lag_window, для подстройки качества потока
+        self._window_lag_total = 0.0
+        self._window_lag_count = 0
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._pending.clear()
+        self._enqueued_at.clear()
+
+    def enable_acks(self, max_in_flight: int):
+        """Включает управление потоком по подтверждениям клиента."""
+        self.max_in_flight = max(1, int(max_in_flight))
+        self._update_credit()
+
+    def ack(self, count: int = 1):
+        """Клиент подтвердил получение count сообщений."""
+        self.in_flight = max(0, self.in_flight - count)
+        self._update_credit()
+
+    def put(self, slot, item):
+        """Кладёт данные камеры, заменяя ещё не отправленные данные этой же камеры."""
+        if slot in self._pending:
+            self.dropped += 1
+        self._pending[slot] = item
+        # задержка считается с момента, когда камера начала ждать отправки, а не с последней замены
+        self._enqueued_at.setdefault(slot, time.monotonic())
+        self._wakeup.set()
+
+    def discard(self, slot):
+        """Убирает из очереди ещё не отправленные данные камеры."""
+        self._pending.pop(slot, None)
+        self._enqueued_at.pop(slot, None)
+
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            'sent_messages': self.sent_messages,
+            'dropped': self.dropped,
+            'pending': len(self._pending),
+            'in_flight': self.in_flight,
+            'avg_lag': self.lag_total / self.lag_count if self.lag_count else 0.0,
+            'max_lag': self.lag_max,
+        }
+
+    def take_lag_window(self) -> Optional[float]:
+        """Средняя задержка в очереди с прошлого вызова (None, если ничего не отправлялось)."""
+        if not self._window_lag_count:
+            return None
+        avg_lag = self._window_lag_total / self._window_lag_count
+        self._window_lag_total = 0.0
+        self._window_lag_count = 0
+        return avg_lag
+
+    def _update_credit(self):
+        if self.max_in_flight is None or self.in_flight < self.max_in_flight:
+            self._credit.set()
+        else:
+            self._credit.clear()
+
+    async def _run(self):
+        while True:
+            try:
+                await self._wakeup.wait()
+                # клиент ещё не подтвердил предыдущие сообщения - данные копятся с заменой
+                await self._credit.wait()
+
+                self._wakeup.clear()
+                if not self._pending:
+                    continue
+
+                items, self._pending = self._pending, {}
+                enqueued_at, self._enqueued_at = self._enqueued_at, {}
+
+                sent = await self._flush(items)
+
+                now = time.monotonic()
+                for slot in items:
+                    lag = now - enqueued_at[slot]
+                    self.lag_total += lag
+                    self.lag_count += 1
+                    self._window_lag_total += lag
+                    self._window_lag_count += 1
+                    if lag > self.lag_max:
+                        self.lag_max = lag
+
+                self.sent_messages += sent
+                if self.max_in_flight is not None:
+                    self.in_flight += sent
+                    self._update_credit()
+
+                if self._pending:
+                    self._wakeup.set()
+
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logging.error(f"{self._name} Ошибка отправки данных клиенту: {e}")
+                break
@@ -1,10 +1,103 @@
-from django.db import transaction
-from api.models import AlertData
+from typing import List, Dict, Optional, Tuple
+
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils.dateparse import parse_datetime
+from api.models import AlertData, Camera
+
+# последовательность номеров тревог в Postgres, создаётся миграцией 0005_alertdata_number_sequence
+ALERT_NUMBER_SEQUENCE = "api_alertdata_number_seq"
+
+ALERT_DATETIME_FIELDS = ("first_detection_datetime", "last_detection_datetime")
+IDEMPOTENCY_KEY_MAX_LENGTH = 64
+
+
+def next_alert_numbers(count: int = 1) -> List[int]:
+    """
+    Следующие count номеров тревог по возрастанию.
+
+    В Postgres номера выдаёт последовательность: nextval не блокирует строки и не
+    ждёт других транзакций, поэтому тревоги со всех камер пишутся параллельно.
+    Номер откаченной вставки не переиспользуется, в нумерации возможны пропуски.
+    В остальных базах (SQLite для разработки и тестов) номера идут после максимального;
+    SQLite выполняет записи по одной, вызывать нужно внутри транзакции вставки.
+    """
+    if count <= 0:
+        return []
+
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT nextval(%s) FROM generate_series(1, %s)", [ALERT_NUMBER_SEQUENCE, count])
+            return sorted(row[0] for row in cursor.fetchall())
+
+    last_number = AlertData.objects.aggregate(last_number=Max('number'))['last_number'] or 0
+    return list(range(last_number + 1, last_number + count + 1))
+
+
+def cameras_for_alerts(items) -> Dict[str, Camera]:
+    """Камеры всех тревог пакета одним запросом; ключ - str(id), camera_id приходит и числом, и строкой."""
+    camera_ids = {str(item.get("camera_id")) for item in items if isinstance(item, dict)}
+    cameras = Camera.objects.in_bulk([camera_id for camera_id in camera_ids if camera_id.isdigit()])
+    return {str(pk): camera for pk, camera in cameras.items()}
+
+
+def build_alert(item, cameras: Dict[str, Camera]) -> Tuple[Optional[AlertData], Optional[str]]:
+    """Несохранённая тревога из данных запроса или текст ошибки, если данные не проходят проверку."""
+    if not isinstance(item, dict):
+        return None, "Ожидается объект alert'а"
+
+    camera_id = item.get("camera_id")
+    if not camera_id:
+        return None, "Поле 'camera_id' обязательно"
+    camera = cameras.get(str(camera_id))
+    if camera is None:
+        return None, f"Камера с id: {camera_id} не найдена"
+
+    idempotency_key = item.get("idempotency_key")
+    if idempotency_key is not None and not isinstance(idempotency_key, str):
+        return None, "idempotency_key должен быть строкой"
+    if idempotency_key and len(idempotency_key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+        return None, f"idempotency_key длиннее {IDEMPOTENCY_KEY_MAX_LENGTH} символов"
+
+    # неверная дата отклоняет только свою тревогу, а не всю вставку
+    for field in ALERT_DATETIME_FIELDS:
+        value = item.get(field)
+        try:
+            if value and parse_datetime(value) is None:
+                raise ValueError
+        except (TypeError, ValueError):
+            return None, f"Поле '{field}' не является датой и временем"
+
+    return AlertData(
+        camera=camera,
+        message=item.get("message", "No message"),
+        first_detection_datetime=item.get("first_detection_datetime"),
+        last_detection_datetime=item.get("last_detection_datetime"),
+        image=item.get("image"),
+        idempotency_key=idempotency_key or None,
+    ), None
+
+
+def assign_alert_numbers(alerts: List[AlertData]):
+    """Присваивает тревогам номера одним блоком в порядке списка."""
+    for alert, number in zip(alerts, next_alert_numbers(len(alerts))):
+        alert.number = number
+
 
 @transaction.atomic
-def create_alert_safely(**kwargs):
-    last_alert = AlertData.objects.select_for_update().order_by('-number').first()
-    next_number = (last_alert.number + 1) if last_alert and last_alert.number is not None else 1
+def create_alerts_bulk(alerts: List[AlertData], ignore_conflicts: bool = False) -> List[AlertData]:
+    """
+    Присваивает тревогам номера одним блоком и вставляет их одним запросом.
+    Тревоги, пронумерованные заранее (пакет, который пишется несколькими вставками),
+    свой номер сохраняют. ignore_conflicts пропускает тревоги с уже записанным
+    idempotency_key (id вставленных тревог при этом не заполняются).
+    """
+    assign_alert_numbers([alert for alert in alerts if alert.number is None])
+    return AlertData.objects.bulk_create(alerts, ignore_conflicts=ignore_conflicts)
+
 
+@transaction.atomic
+def create_alert_safely(**kwargs):
+    next_number, = next_alert_numbers(1)
     alert = AlertData.objects.create(number=next_number, **kwargs)
-    return alert
\ No newline at end of file
+    return alert
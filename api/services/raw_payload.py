@@ -0,0 +1,146 @@
+import json
+from typing import Iterable, Optional, Union
+
+
+# Данные камеры в redis имеют вид {"<ключ камеры>": {...}}, клиенту уходит
+# {"data": {...}} - слияние вложенных объектов всех камер. Функции ниже делают
+# это слияние на уровне байтов: вложенный объект вырезается из сырого значения
+# redis и вклеивается в конверт без json.loads/json.dumps. Повторяющиеся ключи
+# разных камер в конверте разрешаются JSON.parse на клиенте так же, как dict.update.
+
+_WHITESPACE = b" \t\r\n"
+
+
+def _skip_whitespace(data: bytes, pos: int) -> int:
+    while pos < len(data) and data[pos] in _WHITESPACE:
+        pos += 1
+    return pos
+
+
+def _string_end(data: bytes, pos: int) -> int:
+    """pos - индекс открывающей кавычки, возвращает индекс закрывающей или -1."""
+    while True:
+        pos = data.find(b'"', pos + 1)
+        if pos < 0:
+            return -1
+        # кавычка экранирована, если перед ней нечётное число обратных слэшей
+        backslashes = 0
+        while data[pos - 1 - backslashes] == 0x5C:
+            backslashes += 1
+        if backslashes % 2 == 0:
+            return pos
+
+
+def _object_end(data: bytes, start: int) -> int:
+    """
+    Индекс скобки, закрывающей объект, который начинается в start, или -1.
+    Строки (в том числе base64 кадра) пропускаются одним find, посимвольно
+    проходятся только короткие участки структуры между ними.
+    """
+    depth = 0
+    pos = start
+    while pos < len(data):
+        next_quote = data.find(b'"', pos)
+        segment_end = next_quote if next_quote >= 0 else len(data)
+        for i in range(pos, segment_end):
+            char = data[i]
+            if char == 0x7B or char == 0x5B:  # { [
+                depth += 1
+            elif char == 0x7D or char == 0x5D:  # } ]
+                depth -= 1
+                if depth == 0:
+                    return i
+        if next_quote < 0:
+            return -1
+        string_end = _string_end(data, next_quote)
+        if string_end < 0:
+            return -1
+        pos = string_end + 1
+    return -1
+
+
+def extract_camera_body(data: bytes) -> Optional[memoryview]:
+    """
+    Возвращает содержимое вложенного объекта (без фигурных скобок) из значения
+    вида {"<ключ>": {...}} без разбора JSON и без копирования. None, если значение
+    другого вида или вложенный объект пуст.
+    """
+    if not data:
+        return None
+
+    pos = _skip_whitespace(data, 0)
+    if pos >= len(data) or data[pos] != 0x7B:  # {
+        return None
+
+    pos = _skip_whitespace(data, pos + 1)
+    if pos >= len(data) or data[pos] != 0x22:  # "
+        return None
+    key_end = _string_end(data, pos)
+    if key_end < 0:
+        return None
+
+    pos = _skip_whitespace(data, key_end + 1)
+    if pos >= len(data) or data[pos] != 0x3A:  # :
+        return None
+
+    inner_start = _skip_whitespace(data, pos + 1)
+    if inner_start >= len(data) or data[inner_start] != 0x7B:
+        return None
+    inner_end = _object_end(data, inner_start)
+    if inner_end < 0:
+        return None
+
+    # после вложенного объекта сразу закрывается внешний: других ключей нет
+    pos = _skip_whitespace(data, inner_end + 1)
+    if pos >= len(data) or data[pos] != 0x7D:
+        return None
+    if _skip_whitespace(data, pos + 1) != len(data):
+        return None
+
+    # в непустом объекте есть хотя бы один ключ, а значит и кавычка
+    if data.find(b'"', inner_start + 1, inner_end) < 0:
+        return None
+
+    return memoryview(data)[inner_start + 1:inner_end]
+
+
+def extract_string_field(data: bytes, field_names: Iterable[str]) -> Optional[memoryview]:
+    """
+    Значение первого найденного строкового поля из field_names (без кавычек и без
+    копирования). Используется, чтобы достать base64 изображения без разбора JSON.
+    """
+    if not data:
+        return None
+
+    for field_name in field_names:
+        needle = b'"' + field_name.encode("utf-8") + b'"'
+        pos = data.find(needle)
+        while pos >= 0:
+            # совпадение внутри другой строки начинается с экранированной кавычки
+            if pos == 0 or data[pos - 1] != 0x5C:
+                colon = _skip_whitespace(data, pos + len(needle))
+                if colon < len(data) and data[colon] == 0x3A:  # :
+                    value_start = _skip_whitespace(data, colon + 1)
+                    if value_start < len(data) and data[value_start] == 0x22:  # "
+                        value_end = _string_end(data, value_start)
+                        if value_end > 0:
+                            return memoryview(data)[value_start + 1:value_end]
+            pos = data.find(needle, pos + 1)
+    return None
+
+
+def body_from_parsed(redis_data) -> Optional[bytes]:
+    """Запасной путь для значений, которые не удалось разобрать на уровне байтов."""
+    if not redis_data or not isinstance(redis_data, dict):
+        return None
+    key = next(iter(redis_data))
+    inner = redis_data[key]
+    if not isinstance(inner, dict) or not inner:
+        return None
+    return json.dumps(inner).encode("utf-8")[1:-1]
+
+
+def build_data_envelope(bodies: Iterable[Union[bytes, memoryview]], kind: Optional[str] = None) -> bytes:
+    """Склеивает тела камер в конверт {"data": {...}} (с полем "kind", если вид данных задан)."""
+    prefix = b'{"kind": "' + kind.encode("utf-8") + b'", "data": {' if kind else b'{"data": {'
+    return prefix + b", ".join(body for body in bodies if body) + b"}}"
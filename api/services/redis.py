@@ -7,6 +7,15 @@ setup_logging()
 from api.metaclasses.singletone import Singletone
 
 
+# вид данных -> префикс ключа камеры, который пишут nn контейнеры
+DATA_KEY_PREFIXES = {
+    "full": "nn_full_data_",
+    "frame": "only_frame_data_",
+    "alert": "only_alert_status_data_",
+    "thumbnail": "only_thumbnail_data_",
+}
+
+
 class RedisService(metaclass=Singletone):
     def __init__(self):
         try:
@@ -0,0 +1,384 @@
+from api.configs.logger import setup_logging
+setup_logging()
+import logging
+
+import json
+import time
+import asyncio
+from typing import Dict, Any, Optional, Tuple, Iterable, List, Set, Callable
+
+from api.configs.app import (
+    GET_DATA_FROM_REDIS_TO_SOCKET_SLEEP_TIME,
+    REDIS_DB,
+    REDIS_HUB_MODE,
+    REDIS_HUB_UPDATES_CHANNEL,
+    REDIS_HUB_FALLBACK_POLL_INTERVAL,
+    REDIS_HUB_PUSH_COALESCE_TIME,
+    REDIS_NOTIFY_KEYSPACE_EVENTS,
+    WEBSOCKET_FANOUT_MODE,
+)
+from api.metaclasses.singletone import Singletone
+from api.services.redis import DATA_KEY_PREFIXES
+from api.services.raw_payload import extract_camera_body, body_from_parsed
+
+
+class RedisPollerHub(metaclass=Singletone):
+    """
+    Общий на процесс опросчик Redis для всех WebSocket сервисов.
+    Работает через AsyncRedisService, поэтому ожидание redis не блокирует event loop.
+    Все подписанные ключи камер читаются одним MGET за тик, независимо от числа клиентов,
+    результат складывается в общий кэш и раздаётся всем подписанным клиентам.
+    Нагрузка на Redis растёт с числом камер, а не камер × клиентов.
+
+    Значения хранятся сырыми байтами. JSON разбирается лениво и один раз на обновление
+    ключа (get), а для пересылки без разбора есть get_body - вырезанный из сырого
+    значения вложенный объект камеры, который вклеивается в исходящий конверт как есть.
+
+    В режиме push (REDIS_HUB_MODE=push) тик происходит не по таймеру, а по уведомлению
+    об обновлении ключа, и читаются только изменившиеся ключи. Если подписка на
+    уведомления недоступна, опросчик работает по таймеру, как в режиме poll.
+
+    В режиме раздачи через channel layer (WEBSOCKET_FANOUT_MODE=channel_layer) ключ
+    опрашивает только процесс-лидер по этой камере (см. ChannelLayerFanout), в остальных
+    процессах ключ помечен удалённым: данные приходят через ingest, а redis читается
+    только один раз при первой подписке.
+    """
+
+    def __init__(self, redis_service=None):
+        self._redis_service = redis_service
+        # (вид данных, camera_id) -> число подписанных клиентов
+        self._subscriptions: Dict[Tuple[str, Any], int] = {}
+        # (вид данных, camera_id) -> последнее сырое значение из redis
+        self._raw: Dict[Tuple[str, Any], Optional[bytes]] = {}
+        # версия данных ключа (меняется только при изменении значения) и время изменения.
+        # версии берутся из общего счётчика процесса и не повторяются: ключ, у которого
+        # не осталось подписчиков, после новой подписки не получит версию старых данных,
+        # и кэши по версиям (EnvelopeCache, MosaicBuilder) не отдадут устаревшее значение
+        self._versions: Dict[Tuple[str, Any], int] = {}
+        self._version_counter: int = 0
+        self._updated_at: Dict[Tuple[str, Any], float] = {}
+        # лениво вычисляемые из сырого значения представления (разобранный JSON, тело
+        # для конверта, бинарное сообщение...), сбрасываются при обновлении ключа
+        self._derived: Dict[Tuple[str, Any], Dict[str, Any]] = {}
+        # имя ключа в redis -> (вид данных, camera_id), для разбора уведомлений
+        self._redis_key_index: Dict[str, Tuple[str, Any]] = {}
+        self._tick: int = 0
+        self._tick_condition: Optional[asyncio.Condition] = None
+        self._poll_task: Optional[asyncio.Task] = None
+
+        self._push_enabled = REDIS_HUB_MODE == "push"
+        self._push_active = False
+        self._listen_task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dirty: Set[Tuple[str, Any]] = set()
+
+        self._remote_by_default = WEBSOCKET_FANOUT_MODE == "channel_layer"
+        # ключи, данные которых приходят из другого процесса через channel layer, а не опросом
+        self._remote: Set[Tuple[str, Any]] = set()
+        # ключи, которые нужно прочитать из redis один раз (новая подписка)
+        self._prime: Set[Tuple[str, Any]] = set()
+        logging.info(f"RedisPollerHub инициализирован, режим: {REDIS_HUB_MODE}")
+
+    def subscribe(self, kind: str, camera_ids: Iterable):
+        """Подписывает клиента на ключи камер, запускает опрос при первой подписке."""
+        if kind not in DATA_KEY_PREFIXES:
+            raise ValueError(f"Неизвестный вид данных: {kind}")
+
+        for camera_id in camera_ids:
+            key = (kind, camera_id)
+            if key not in self._subscriptions:
+                self._redis_key_index[self._redis_key(key)] = key
+                # новый ключ читаем сразу, не дожидаясь уведомления или данных от лидера
+                self._prime.add(key)
+                if self._remote_by_default:
+                    self._remote.add(key)
+            self._subscriptions[key] = self._subscriptions.get(key, 0) + 1
+
+        self._ensure_started()
+        if self._push_active and self._prime:
+            self._get_wakeup().set()
+
+    def unsubscribe(self, kind: str, camera_ids: Iterable):
+        """Снимает подписку клиента, ключи без подписчиков больше не опрашиваются."""
+        for camera_id in camera_ids:
+            key = (kind, camera_id)
+            count = self._subscriptions.get(key, 0) - 1
+            if count > 0:
+                self._subscriptions[key] = count
+            else:
+                self._subscriptions.pop(key, None)
+                self._raw.pop(key, None)
+                self._versions.pop(key, None)
+                self._updated_at.pop(key, None)
+                self._derived.pop(key, None)
+                self._redis_key_index.pop(self._redis_key(key), None)
+                self._remote.discard(key)
+                self._prime.discard(key)
+
+    def subscribed_keys(self) -> List[Tuple[str, Any]]:
+        """Ключи (вид данных, camera_id), на которые в процессе есть подписчики."""
+        return list(self._subscriptions)
+
+    def set_remote(self, kind: str, camera_id, remote: bool):
+        """
+        Помечает ключ удалённым (данные приходят через ingest) или локальным
+        (опрашивается этим процессом). Ставший локальным ключ читается сразу.
+        """
+        key = (kind, camera_id)
+        if key not in self._subscriptions:
+            return
+        if remote:
+            self._remote.add(key)
+        elif key in self._remote:
+            self._remote.discard(key)
+            self._prime.add(key)
+            if self._push_active:
+                self._get_wakeup().set()
+
+    async def ingest(self, kind: str, camera_id, raw: Optional[bytes], updated_at: float):
+        """Данные удалённого ключа, прочитанные процессом-лидером и пришедшие через channel layer."""
+        key = (kind, camera_id)
+        if key not in self._remote:
+            return
+        # сообщение от прежнего лидера могло прийти позже свежих данных
+        if updated_at < self._updated_at.get(key, 0.0):
+            return
+        if self._store(key, raw, updated_at):
+            await self._notify()
+
+    def get(self, kind: str, camera_id):
+        """Последние данные камеры из общего кэша (без обращения к redis)."""
+        return self.get_derived(kind, camera_id, "parsed", self._parse)
+
+    def get_body(self, kind: str, camera_id):
+        """
+        Вложенный объект камеры в байтах (без фигурных скобок) для сборки конверта
+        без json.loads/json.dumps. None, если данных нет.
+        """
+        def factory(raw):
+            body = extract_camera_body(raw)
+            if body is None:
+                # значение нестандартного вида - собираем через json
+                body = body_from_parsed(self.get(kind, camera_id))
+            return body
+
+        return self.get_derived(kind, camera_id, "body", factory)
+
+    def get_derived(self, kind: str, camera_id, name: str, factory: Callable[[bytes], Any]):
+        """
+        Представление данных камеры, которое вычисляется factory(сырое значение) один раз
+        на обновление ключа и общее для всех клиентов. None, если данных нет.
+        """
+        key = (kind, camera_id)
+        derived = self._derived.get(key)
+        if derived is not None and name in derived:
+            return derived[name]
+
+        raw = self._raw.get(key)
+        value = factory(raw) if raw else None
+
+        if key in self._raw:
+            self._derived.setdefault(key, {})[name] = value
+        return value
+
+    def get_raw(self, kind: str, camera_id) -> Optional[bytes]:
+        """Последнее сырое значение ключа камеры."""
+        return self._raw.get((kind, camera_id))
+
+    def get_version(self, kind: str, camera_id) -> int:
+        """
+        Версия данных камеры: меняется только когда значение в redis изменилось.
+        Клиенту достаточно сравнить её с версией последней отправки - O(1) на камеру.
+        """
+        return self._versions.get((kind, camera_id), 0)
+
+    def get_meta(self, kind: str, camera_id) -> Tuple[int, float]:
+        """Версия данных и время последнего изменения ключа камеры."""
+        key = (kind, camera_id)
+        return self._versions.get(key, 0), self._updated_at.get(key, 0.0)
+
+    def _parse(self, raw: bytes):
+        try:
+            return json.loads(raw)
+        except json.JSONDecodeError as e:
+            logging.error(f"Redis: invalid JSON data: {str(e)}")
+            return None
+
+    @property
+    def tick(self) -> int:
+        return self._tick
+
+    async def wait_for_tick(self, last_tick: int) -> int:
+        """Ждёт следующего тика опроса и возвращает его номер."""
+        condition = self._get_condition()
+        async with condition:
+            await condition.wait_for(lambda: self._tick != last_tick)
+        return self._tick
+
+    @staticmethod
+    def _redis_key(key: Tuple[str, Any]) -> str:
+        kind, camera_id = key
+        return f"{DATA_KEY_PREFIXES[kind]}{camera_id}"
+
+    def _get_condition(self) -> asyncio.Condition:
+        # создаётся лениво, внутри работающего event loop
+        if self._tick_condition is None:
+            self._tick_condition = asyncio.Condition()
+        return self._tick_condition
+
+    def _get_wakeup(self) -> asyncio.Event:
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        return self._wakeup
+
+    def _ensure_started(self):
+        if self._poll_task is None or self._poll_task.done():
+            self._poll_task = asyncio.create_task(self._poll_loop())
+            logging.info("RedisPollerHub: запущен общий опрос redis")
+
+        if self._push_enabled and (self._listen_task is None or self._listen_task.done()):
+            self._listen_task = asyncio.create_task(self._listen_loop())
+
+    async def _poll_loop(self):
+        interval = GET_DATA_FROM_REDIS_TO_SOCKET_SLEEP_TIME
+
+        while True:
+            try:
+                if not self._subscriptions or not self._redis_service:
+                    await asyncio.sleep(interval)
+                    continue
+
+                if self._push_active:
+                    keys = await self._wait_for_push()
+                else:
+                    self._dirty.clear()
+                    keys = self._local_keys()
+
+                if self._prime:
+                    primed = [key for key in self._prime if key in self._subscriptions and key not in keys]
+                    self._prime.clear()
+                    keys = keys + primed
+
+                if keys:
+                    await self._fetch(keys)
+                    await self._notify()
+
+                if not self._push_active:
+                    await asyncio.sleep(interval)
+
+            except asyncio.CancelledError:
+                logging.info("RedisPollerHub: общий опрос redis остановлен")
+                break
+            except Exception as e:
+                logging.error(f"RedisPollerHub: ошибка опроса redis: {e}")
+                await asyncio.sleep(interval)
+
+    def _local_keys(self) -> List[Tuple[str, Any]]:
+        return [key for key in self._subscriptions if key not in self._remote]
+
+    async def _notify(self):
+        condition = self._get_condition()
+        async with condition:
+            self._tick += 1
+            condition.notify_all()
+
+    def _store(self, key: Tuple[str, Any], raw: Optional[bytes], updated_at: float) -> bool:
+        """Сохраняет новое значение ключа. False, если значение не изменилось."""
+        # значение не изменилось: версия и вычисленные представления остаются прежними.
+        # сравнение байтов выполняется один раз на камеру, а не для каждого клиента
+        if key in self._raw and self._raw[key] == raw:
+            return False
+        self._raw[key] = raw
+        self._version_counter += 1
+        self._versions[key] = self._version_counter
+        self._updated_at[key] = updated_at
+        self._derived.pop(key, None)
+        return True
+
+    async def _fetch(self, keys: List[Tuple[str, Any]]):
+        redis_keys = [self._redis_key(key) for key in keys]
+        # один round trip на все камеры и виды данных
+        values = await self._redis_service.get_many_raw(redis_keys)
+
+        now = time.time()
+        for key, raw in zip(keys, values):
+            # пока ждали ответ redis, клиент мог отписаться
+            if key not in self._subscriptions:
+                continue
+            self._store(key, raw, now)
+
+    async def _wait_for_push(self) -> List[Tuple[str, Any]]:
+        """Ждёт уведомления об обновлении ключей и возвращает изменившиеся ключи."""
+        wakeup = self._get_wakeup()
+        try:
+            await asyncio.wait_for(wakeup.wait(), timeout=REDIS_HUB_FALLBACK_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            # страховочный полный опрос: уведомление могло потеряться
+            self._dirty.clear()
+            return self._local_keys()
+
+        # даём пачке уведомлений от разных камер собраться в одно чтение
+        if REDIS_HUB_PUSH_COALESCE_TIME > 0:
+            await asyncio.sleep(REDIS_HUB_PUSH_COALESCE_TIME)
+
+        wakeup.clear()
+        dirty, self._dirty = self._dirty, set()
+        return [key for key in dirty if key in self._subscriptions and key not in self._remote]
+
+    async def _listen_loop(self):
+        """Слушает keyspace notifications и канал обновлений, помечает изменившиеся ключи."""
+        patterns = [f"__keyspace@{REDIS_DB}__:{prefix}*" for prefix in DATA_KEY_PREFIXES.values()]
+
+        while True:
+            pubsub = None
+            try:
+                client = self._redis_service.get_redis_client()
+                if REDIS_NOTIFY_KEYSPACE_EVENTS:
+                    await client.config_set("notify-keyspace-events", REDIS_NOTIFY_KEYSPACE_EVENTS)
+
+                pubsub = client.pubsub(ignore_subscribe_messages=True)
+                await pubsub.psubscribe(*patterns)
+                await pubsub.subscribe(REDIS_HUB_UPDATES_CHANNEL)
+                self._push_active = True
+                logging.info("RedisPollerHub: подписка на уведомления redis активна, режим push")
+
+                while True:
+                    # явный таймаут: простаивающий pubsub не должен упираться в socket_timeout
+                    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                    if message:
+                        self._on_push_message(message)
+
+            except asyncio.CancelledError:
+                self._push_active = False
+                logging.info("RedisPollerHub: подписка на уведомления redis остановлена")
+                break
+            except Exception as e:
+                self._push_active = False
+                logging.error(f"RedisPollerHub: ошибка подписки на уведомления, работаем опросом: {e}")
+                await asyncio.sleep(REDIS_HUB_FALLBACK_POLL_INTERVAL)
+            finally:
+                if pubsub is not None:
+                    try:
+                        await pubsub.aclose()
+                    except Exception:
+                        pass
+
+    def _on_push_message(self, message: dict):
+        channel = message.get("channel")
+        data = message.get("data")
+        if isinstance(channel, bytes):
+            channel = channel.decode("utf-8")
+        if isinstance(data, bytes):
+            data = data.decode("utf-8")
+
+        if message.get("type") == "pmessage":
+            # канал вида __keyspace@0__:only_frame_data_1, data - имя команды (set, del, expired...)
+            redis_key = channel.split(":", 1)[1]
+        else:
+            # nn контейнер публикует в канал имя обновлённого ключа
+            redis_key = data
+
+        key = self._redis_key_index.get(redis_key)
+        if key is not None:
+            self._dirty.add(key)
+            self._get_wakeup().set()
@@ -0,0 +1,748 @@
+from api.configs.logger import setup_logging
+setup_logging()
+import logging
+
+import json
+import time
+import asyncio
+from typing import Dict, Any, Optional, Tuple, Set
+
+from channels.generic.websocket import AsyncWebsocketConsumer
+from rest_framework_simplejwt.tokens import TokenError
+
+from api.configs.app import (
+    GET_DATA_FROM_REDIS_TO_SOCKET_SLEEP_TIME,
+    WEBSOCKET_RAW_PASSTHROUGH_KINDS,
+    WEBSOCKET_MAX_IN_FLIGHT,
+    WEBSOCKET_CAMERA_LIST,
+    WEBSOCKET_FANOUT_MODE,
+    WEBSOCKET_CLIENT_TIMEOUT,
+    WEBSOCKET_QUALITY_TIERS,
+    WEBSOCKET_TIER_DOWNGRADE_LAG,
+    WEBSOCKET_TIER_UPGRADE_LAG,
+    WEBSOCKET_TIER_ADAPT_INTERVAL,
+    WEBSOCKET_COMPRESSION_KINDS,
+    WEBSOCKET_COMPRESSION_MIN_SIZE,
+    WEBSOCKET_DELTA_KINDS,
+)
+from api.services.redis import DATA_KEY_PREFIXES
+from api.services.redis_hub import RedisPollerHub
+from api.services.outbox import LatestWinsOutbox
+from api.services.channel_fanout import ChannelLayerFanout
+from api.services.liveness import ClientLivenessMonitor
+from api.services.mosaic import MosaicBuilder, MOSAIC_KIND
+from api.services.envelope_cache import EnvelopeCache
+from api.services.jwt_cache import VerifiedTokenCache
+from api.services.websocket_auth import get_access_token
+from api.services.compression import COMPRESSION_DEFLATE, DeflateCompressor
+from api.services.merge_patch import merge_patch_diff
+from api.services.raw_payload import build_data_envelope, body_from_parsed
+from api.services.binary_protocol import (
+    BINARY_PROTOCOL,
+    JSON_PROTOCOL,
+    BINARY_KIND_CODES,
+    get_image_message,
+)
+
+
+# виды данных, для которых клиент, не приславший camera_list, получает все камеры
+# из WEBSOCKET_CAMERA_LIST (прежнее поведение сокетов алертов и миниатюр)
+DEFAULT_CAMERA_LIST_KINDS = ("alert", "thumbnail")
+
+# виды данных, для которых клиент может выбрать уровень качества (WEBSOCKET_QUALITY_TIERS)
+TIERED_KINDS = ("frame",)
+TIER_NAMES = list(WEBSOCKET_QUALITY_TIERS)
+
+
+class StreamingWebSocketService(AsyncWebsocketConsumer):
+    """
+    Общий движок раздачи данных камер из redis в websocket.
+
+    Вид данных (full, frame, alert, thumbnail - ключи DATA_KEY_PREFIXES) задаётся
+    параметром подкласса, поэтому подключение, проверка JWT из cookies, подписка в
+    общем опросчике, отправка только изменившихся камер, очередь latest-wins и
+    бинарный протокол реализованы один раз для всех сервисов.
+
+    Подкласс с несколькими видами данных раздаёт их по одному соединению: клиент
+    присылает {"streams": {"frame": [1, 2], "alert": [1, 2, 3]}}, текстовые сообщения
+    приходят с полем "kind", бинарные несут вид данных в заголовке.
+    Подкласс с одним видом данных работает по прежнему протоколу: {"camera_list": [...]}
+    и сообщения {"data": {...}}.
+
+    Подписка меняется на месте, задача отправки живёт всё время соединения:
+    {"type": "subscribe", "camera_list": [3]} / {"type": "unsubscribe", "camera_list": [1]}
+    (для нескольких видов данных - "streams": {"frame": [3]}) или {"add": [3], "remove": [1]}.
+    Новый полный camera_list тоже применяется разницей со старым: камеры, которые
+    остались, не пересылаются заново. Список заменяет только сообщение с camera_list
+    или streams; {"tier": ...} и {"mode": ...} без них камеры клиента не меняют.
+
+    При WEBSOCKET_FANOUT_MODE=channel_layer данные камер, которые опрашивают другие
+    процессы daphne, приходят в опросчик процесса через канал процесса в группах
+    channel layer camera.<id>.<вид данных> (см. ChannelLayerFanout); клиенты в группы не вступают.
+
+    Клиент, который прислал {"type": "ping"} и после этого дольше inactive_timeout
+    секунд ничего не присылает (ping, ack, подписка), закрывается общим
+    ClientLivenessMonitor. Клиенты, которые только принимают данные и ping не шлют,
+    так не закрываются: оборванные соединения таких клиентов закрывает daphne
+    по ping/pong websocket (по умолчанию раз в 20 секунд).
+
+    Для кадров клиент может выбрать уровни качества: {"tier": "grid", "tiers": {"3": "focus"}}
+    (в сообщении с camera_list или отдельным {"type": "tier", ...}). Уровень задаёт, что
+    уходит вместо кадра (кадр или миниатюра) и с какой частотой. У клиента с подтверждениями
+    ("ack": true) при росте средней задержки отправки все камеры опускаются на уровень
+    ниже, потом поднимаются обратно; без подтверждений уровни не меняются.
+
+    Миниатюры можно получать одной мозаикой ({"mode": "mosaic"}, обратно - "tiles"):
+    при изменении раскладки приходит {"mosaic": {"cameras", "columns", "rows", "tile_size"}},
+    затем на каждое обновление - одно изображение {"data": {"mosaic": "<base64 JPEG>"}}
+    или бинарное сообщение вида 3. Мозаика общая для всех клиентов с тем же набором камер.
+
+    JSON потоки из WEBSOCKET_COMPRESSION_KINDS клиент может получать сжатыми
+    ({"compression": "deflate"} в первом сообщении, формат - в api.services.compression).
+
+    Потоки из WEBSOCKET_DELTA_KINDS клиент может получать изменениями ("delta": true в
+    первом сообщении): новая камера приходит полным снимком {"data": {...}}, дальше -
+    {"patch": {...}}, JSON merge patch (RFC 7386) к последнему отправленному состоянию.
+    Если изменение патчем не выражается (новое значение null), камера снова приходит
+    снимком. {"type": "resync"} заново присылает снимки всех камер.
+    """
+
+    # виды данных, которые раздаёт подкласс, и префикс для логов
+    kinds: Tuple[str, ...] = ()
+    name: str = "StreamingWebSocket"
+    inactive_timeout: float = WEBSOCKET_CLIENT_TIMEOUT
+
+    _redis_service = None
+    _hub: Optional[RedisPollerHub] = None
+    _fanout: Optional[ChannelLayerFanout] = None
+    # у каждого подкласса свой словарь клиентов
+    _clients: Dict[int, Dict[str, Any]] = {}
+    _initialized = False
+
+    def __init__(self, redis_service=None):
+        super().__init__()
+        cls = type(self)
+        if not cls._initialized and redis_service is not None:
+            for kind in cls.kinds:
+                if kind not in DATA_KEY_PREFIXES:
+                    raise ValueError(f"Неизвестный вид данных: {kind}")
+            cls._redis_service = redis_service
+            cls._hub = RedisPollerHub(redis_service)
+            if WEBSOCKET_FANOUT_MODE == "channel_layer":
+                cls._fanout = ChannelLayerFanout(cls._hub, redis_service)
+            cls._initialized = True
+            logging.info(f"{cls.name} инициализирован, виды данных: {', '.join(cls.kinds)}")
+
+        self.client_id: Optional[int] = None
+        # вид данных -> список камер клиента
+        self.camera_lists: Dict[str, list] = {}
+        # ключи (вид данных в redis, camera_id), на которые клиент подписан в общем опросчике
+        self.hub_keys: Set[Tuple[str, Any]] = set()
+        # вид данных -> camera_id -> (вид данных в redis, версия), отправленные клиенту последними
+        self.sent_versions: Dict[str, Dict[Any, Tuple[str, int]]] = {}
+        # уровни качества: включены, если клиент их выбрал
+        self.default_tier: Optional[str] = None
+        self.camera_tiers: Dict[str, str] = {}
+        # на сколько уровней сервер опустил клиента из-за задержки отправки
+        self.tier_penalty: int = 0
+        # (вид данных, camera_id) -> время, раньше которого камеру не отправлять (ограничение fps)
+        self.next_send_at: Dict[Tuple[str, Any], float] = {}
+        # миниатюры одной мозаикой и раскладка мозаики, отправленная клиенту последней
+        self.mosaic: bool = False
+        self.mosaic_layout: Optional[Dict[str, Any]] = None
+        self.data_task: Optional[asyncio.Task] = None
+        self.is_running: bool = False
+        self.outbox: Optional[LatestWinsOutbox] = None
+        self.protocol: str = JSON_PROTOCOL
+        # сжатие текстовых сообщений, если клиент его запросил
+        self.compressor: Optional[DeflateCompressor] = None
+        # отправка изменениями и (вид данных, camera_id) -> последнее отправленное состояние камеры
+        self.delta: bool = False
+        self.delta_state: Dict[Tuple[str, Any], dict] = {}
+
+    @classmethod
+    def get_redis_service(cls):
+        return cls._redis_service
+
+    @property
+    def is_multi_stream(self) -> bool:
+        return len(self.kinds) > 1
+
+    async def connect(self):
+        """Обработка нового подключения с проверкой JWT из cookies."""
+        cls = type(self)
+        try:
+            access_token = get_access_token(self.scope)
+
+            if not access_token or not self.authenticate_token(access_token):
+                logging.warning(f"{self.name}-подключение отклонено: неверный токен")
+                await self.send(json.dumps({"error": "403 Forbidden: Invalid token"}))
+                await self.close(code=403)
+                return
+
+            self.client_id = id(self)
+            cls._clients[self.client_id] = {
+                'connection': self,
+                'camera_lists': self.camera_lists,
+                'is_active': True,
+            }
+            await self.accept()
+            self.outbox = LatestWinsOutbox(self._flush, self.name)
+            self.outbox.start()
+            logging.info(f"Новое {self.name} подключение (ID: {self.client_id}). "
+                         f"Всего подключений: {len(cls._clients)}")
+        except Exception as e:
+            logging.error(f"{self.name} Ошибка при подключении: {e}")
+            await self.close()
+
+    def authenticate_token(self, token):
+        """Проверяет валидность JWT-токена."""
+        try:
+            VerifiedTokenCache().validate(token)
+            return True
+        except TokenError:
+            logging.warning(f"{self.name} Токен недействителен или истек")
+            return False
+        except Exception as e:
+            logging.error(f"{self.name} Ошибка проверки токена: {e}")
+            return False
+
+    async def disconnect(self, close_code):
+        ClientLivenessMonitor().unregister(self)
+        try:
+            if await self._release():
+                logging.info(f"{self.name} отключен (ID: {self.client_id}). "
+                             f"Осталось подключений: {len(type(self)._clients)}")
+        except Exception as e:
+            logging.error(f"{self.name} Ошибка при отключении клиента {self.client_id}: {e}")
+
+    async def reap(self):
+        """Закрывает неактивного клиента: останавливает отправку и снимает подписки, не дожидаясь disconnect."""
+        await self._release()
+        logging.info(f"{self.name} Удалён неактивный клиент (ID: {self.client_id}). "
+                     f"Осталось подключений: {len(type(self)._clients)}")
+        await self.close(code=4001)
+
+    async def _release(self) -> bool:
+        """Освобождает ресурсы клиента. False, если они уже освобождены."""
+        cls = type(self)
+        if self.client_id not in cls._clients:
+            return False
+        del cls._clients[self.client_id]
+        await self._stop_data_task()
+        if self.outbox:
+            await self.outbox.stop()
+        for kind in list(self.camera_lists):
+            await self._update_hub_subscription(kind, [])
+        return True
+
+    async def receive(self, text_data=None, bytes_data=None):
+        cls = type(self)
+        try:
+            data = json.loads(text_data)
+
+            if self.client_id not in cls._clients:
+                return
+            ClientLivenessMonitor().touch(self)
+
+            # ping продлевает жизнь соединения; с первого ping клиент проверяется на активность
+            if data.get("type") == "ping":
+                ClientLivenessMonitor().register(self)
+                return
+
+            # подтверждение полученных сообщений не меняет подписку
+            if data.get("type") == "ack":
+                if self.outbox:
+                    self.outbox.ack(int(data.get("count", 1)))
+                return
+
+            # клиент потерял состояние: следующие данные камер уходят полными снимками
+            if data.get("type") == "resync":
+                self._resync_delta()
+                return
+
+            # подтверждения и протокол включаются один раз, в первом сообщении клиента
+            if self.data_task is None:
+                if data.get("ack") and self.outbox:
+                    self.outbox.enable_acks(WEBSOCKET_MAX_IN_FLIGHT)
+                if data.get("protocol") == BINARY_PROTOCOL and any(kind in BINARY_KIND_CODES for kind in self.kinds):
+                    self.protocol = BINARY_PROTOCOL
+                    await self.send(text_data=json.dumps({"protocol": BINARY_PROTOCOL}))
+                if (data.get("compression") == COMPRESSION_DEFLATE
+                        and any(kind in WEBSOCKET_COMPRESSION_KINDS for kind in self.kinds)):
+                    self.compressor = DeflateCompressor()
+                    await self.send(text_data=json.dumps({"compression": COMPRESSION_DEFLATE}))
+                if data.get("delta") and any(kind in WEBSOCKET_DELTA_KINDS for kind in self.kinds):
+                    self.delta = True
+                    await self.send(text_data=json.dumps({"delta": True}))
+
+            # уровни качества можно прислать с подпиской или отдельно
+            if "tier" in data or "tiers" in data:
+                self._apply_tiers(data)
+                if data.get("type") == "tier":
+                    await self._sync_hub_subscription()
+                    logging.info(f"{self.name} Клиент {self.client_id} выбрал уровни качества: "
+                                 f"{self.default_tier}, {self.camera_tiers}")
+                    return
+
+            # мозаика миниатюр вместо отдельных миниатюр камер
+            if data.get("mode") in ("mosaic", "tiles") and "thumbnail" in self.kinds:
+                await self._set_mosaic(data["mode"] == "mosaic")
+                if data.get("type") == "mode":
+                    return
+
+            # подписка и отписка меняют список камер на месте, без перезапуска отправки
+            message_type = data.get("type")
+            if message_type in ("subscribe", "unsubscribe"):
+                cameras = self._per_kind(data.get("streams") if self.is_multi_stream and "streams" in data
+                                         else data.get("camera_list"))
+                for kind, camera_list in cameras.items():
+                    if message_type == "subscribe":
+                        await self._apply_camera_delta(kind, camera_list, [])
+                    else:
+                        await self._apply_camera_delta(kind, [], camera_list)
+            elif "add" in data or "remove" in data:
+                added = self._per_kind(data.get("add"))
+                removed = self._per_kind(data.get("remove"))
+                for kind in self.kinds:
+                    await self._apply_camera_delta(kind, added.get(kind, []), removed.get(kind, []))
+            elif "camera_list" in data or "streams" in data or self.data_task is None:
+                for kind, camera_list in self._requested_camera_lists(data).items():
+                    await self._update_hub_subscription(kind, camera_list)
+            else:
+                # уровни качества или режим без списка камер не меняют камеры клиента
+                if "tier" in data or "tiers" in data:
+                    await self._sync_hub_subscription()
+                return
+
+            logging.info(f"{self.name} Клиент {self.client_id} обновил список камер: {self.camera_lists}")
+            self._ensure_data_task()
+
+        except json.JSONDecodeError:
+            logging.error(f"{self.name} Ошибка декодирования JSON: {text_data}")
+        except Exception as e:
+            logging.error(f"{self.name} Ошибка обработки сообщения: {e}")
+
+    def _requested_camera_lists(self, data: dict) -> Dict[str, list]:
+        """Списки камер по видам данных из сообщения клиента."""
+        if self.is_multi_stream and isinstance(data.get("streams"), dict):
+            streams = data["streams"]
+            requested = {kind: list(streams.get(kind) or []) for kind in self.kinds}
+        else:
+            camera_list = list(data.get("camera_list") or [])
+            requested = {kind: camera_list for kind in self.kinds}
+
+        if not self.is_multi_stream and "camera_list" not in data:
+            for kind in DEFAULT_CAMERA_LIST_KINDS:
+                if kind in requested:
+                    requested[kind] = list(WEBSOCKET_CAMERA_LIST)
+        return requested
+
+    def _per_kind(self, value) -> Dict[str, list]:
+        """Камеры из сообщения по видам данных: список - для всех видов, словарь - по виду."""
+        if isinstance(value, dict):
+            return {kind: list(value.get(kind) or []) for kind in self.kinds}
+        if isinstance(value, list):
+            return {kind: list(value) for kind in self.kinds}
+        return {}
+
+    async def _apply_camera_delta(self, kind: str, added: list, removed: list):
+        """Добавляет и убирает камеры клиента, не трогая остальные."""
+        if not added and not removed:
+            return
+        camera_list = [camera_id for camera_id in self.camera_lists.get(kind, []) if camera_id not in removed]
+        camera_list += [camera_id for camera_id in dict.fromkeys(added) if camera_id not in camera_list]
+        await self._update_hub_subscription(kind, camera_list)
+
+    def _apply_tiers(self, data: dict):
+        """Уровни качества из сообщения клиента: общий "tier" и "tiers" по камерам."""
+        tier = data.get("tier")
+        if tier in WEBSOCKET_QUALITY_TIERS:
+            self.default_tier = tier
+        tiers = data.get("tiers")
+        if isinstance(tiers, dict):
+            self.camera_tiers = {str(camera_id): name for camera_id, name in tiers.items()
+                                 if name in WEBSOCKET_QUALITY_TIERS}
+        if self.camera_tiers and self.default_tier is None:
+            self.default_tier = TIER_NAMES[0]
+
+    async def _set_mosaic(self, enabled: bool):
+        if enabled and not MosaicBuilder.is_available():
+            logging.warning(f"{self.name} Клиент {self.client_id} запросил мозаику, но Pillow не установлен")
+            await self.send(text_data=json.dumps({"error": "Mosaic mode is unavailable: Pillow is not installed"}))
+            return
+        if enabled == self.mosaic:
+            return
+        self.mosaic = enabled
+        self.mosaic_layout = None
+        # после переключения миниатюры отправляются заново в новом виде
+        self.sent_versions.pop("thumbnail", None)
+        if self.outbox:
+            self.outbox.discard(("thumbnail", MOSAIC_KIND))
+            for camera_id in self.camera_lists.get("thumbnail", []):
+                self.outbox.discard(("thumbnail", camera_id))
+
+    async def _queue_mosaic(self) -> int:
+        """Ставит в очередь общую мозаику миниатюр, если миниатюры или набор камер изменились."""
+        camera_list = self.camera_lists.get("thumbnail", [])
+        changed = self._changed_cameras("thumbnail")
+        layout_changed = self.mosaic_layout is None or self.mosaic_layout["cameras"] != camera_list
+        if not camera_list or not (changed or layout_changed):
+            return 0
+
+        entry = await MosaicBuilder(type(self)._hub).get(camera_list)
+        if entry is None:
+            self.sent_versions.setdefault("thumbnail", {}).update(changed)
+            return 0
+        # запоминаются версии миниатюр, из которых мозаика собрана на самом деле:
+        # камера, обновившаяся во время сборки, попадёт в следующую мозаику
+        self.sent_versions.setdefault("thumbnail", {}).update(
+            (camera_id, ("thumbnail", version))
+            for camera_id, version in zip(entry["layout"]["cameras"], entry["versions"])
+        )
+
+        if entry["layout"] != self.mosaic_layout:
+            self.mosaic_layout = entry["layout"]
+            await self.send(text_data=json.dumps({"mosaic": self.mosaic_layout}))
+        item = entry["binary"] if self.protocol == BINARY_PROTOCOL else entry["body"]
+        self.outbox.put(("thumbnail", MOSAIC_KIND), (MOSAIC_KIND, entry["versions"], item))
+        return 1
+
+    def _is_delta(self, kind: str) -> bool:
+        return self.delta and kind in WEBSOCKET_DELTA_KINDS
+
+    def _resync_delta(self):
+        """Забывает отправленные состояния, чтобы все камеры ушли заново полными снимками."""
+        for kind in self.camera_lists:
+            if self._is_delta(kind):
+                self.sent_versions.pop(kind, None)
+        self.delta_state.clear()
+        logging.info(f"{self.name} Клиент {self.client_id} запросил полные снимки камер")
+
+    def _tier(self, kind: str, camera_id) -> Optional[dict]:
+        """Действующий уровень качества камеры с учётом понижения сервером, None - без уровней."""
+        if kind not in TIERED_KINDS or self.default_tier is None:
+            return None
+        name = self.camera_tiers.get(str(camera_id), self.default_tier)
+        index = min(TIER_NAMES.index(name) + self.tier_penalty, len(TIER_NAMES) - 1)
+        return WEBSOCKET_QUALITY_TIERS[TIER_NAMES[index]]
+
+    def _source_kind(self, kind: str, camera_id) -> str:
+        """Вид данных в redis, из которого берутся данные камеры для клиента."""
+        tier = self._tier(kind, camera_id)
+        return tier.get("kind", kind) if tier else kind
+
+    def _adapt_tier(self):
+        """Опускает или поднимает уровень качества клиента по средней задержке отправки."""
+        avg_lag = self.outbox.take_lag_window()
+        # без подтверждений send не ждёт клиента и задержка в очереди всегда около нуля:
+        # по ней нельзя понять, что клиент отстаёт, поэтому уровень остаётся выбранным клиентом
+        if self.default_tier is None or self.outbox.max_in_flight is None:
+            return False
+        if avg_lag is None:
+            # ничего не отправлялось: клиент не отстаёт, если очередь пуста и всё подтверждено
+            if self.outbox.pending() or self.outbox.in_flight:
+                return False
+            avg_lag = 0.0
+        if avg_lag > WEBSOCKET_TIER_DOWNGRADE_LAG and self.tier_penalty < len(TIER_NAMES) - 1:
+            self.tier_penalty += 1
+        elif avg_lag < WEBSOCKET_TIER_UPGRADE_LAG and self.tier_penalty > 0:
+            self.tier_penalty -= 1
+        else:
+            return False
+        logging.info(f"{self.name} Клиент {self.client_id}: задержка отправки {avg_lag * 1000:.0f} мс, "
+                     f"понижение уровня качества: {self.tier_penalty}")
+        return True
+
+    def _ensure_data_task(self):
+        if self.data_task is None or self.data_task.done():
+            self.is_running = True
+            self.data_task = asyncio.create_task(self._get_and_send_data())
+
+    async def _stop_data_task(self):
+        self.is_running = False
+        if self.data_task and not self.data_task.done():
+            self.data_task.cancel()
+            try:
+                await self.data_task
+            except asyncio.CancelledError:
+                pass
+
+    async def _update_hub_subscription(self, kind: str, camera_list):
+        """Меняет список камер клиента и переподписывает его в общем опросчике redis."""
+        previous_cameras = self.camera_lists.get(kind, [])
+        current_cameras = list(camera_list or [])
+        self.camera_lists[kind] = current_cameras
+
+        sent_versions = self.sent_versions.setdefault(kind, {})
+        for camera_id in set(previous_cameras) - set(current_cameras):
+            sent_versions.pop(camera_id, None)
+            self.next_send_at.pop((kind, camera_id), None)
+            self.delta_state.pop((kind, camera_id), None)
+            # данные убранной камеры, ещё не ушедшие клиенту, больше не нужны
+            if self.outbox:
+                self.outbox.discard((kind, camera_id))
+
+        await self._sync_hub_subscription()
+
+    async def _sync_hub_subscription(self):
+        """Приводит подписки клиента в общем опросчике к его камерам и уровням качества."""
+        cls = type(self)
+        hub = cls._hub
+        if not hub:
+            return
+        wanted = {
+            (self._source_kind(kind, camera_id), camera_id)
+            for kind, camera_list in self.camera_lists.items()
+            for camera_id in camera_list
+        }
+        added = wanted - self.hub_keys
+        removed = self.hub_keys - wanted
+        self.hub_keys = wanted
+
+        # сначала подписка, затем отписка, чтобы общие камеры не теряли данные в кэше
+        for kind, camera_id in added:
+            hub.subscribe(kind, [camera_id])
+        for kind, camera_id in removed:
+            hub.unsubscribe(kind, [camera_id])
+
+        if cls._fanout and (added or removed):
+            cls._fanout.start()
+            await cls._fanout.sync_groups()
+
+    def _changed_cameras(self, kind: str) -> Dict[Any, Tuple[str, int]]:
+        """
+        Камеры, данные которых изменились с последней отправки этому клиенту и которые
+        уже можно отправить по частоте их уровня качества, и их версии.
+        """
+        hub = type(self)._hub
+        sent_versions = self.sent_versions.get(kind, {})
+        now = time.monotonic()
+        changed = {}
+        for camera_id in self.camera_lists.get(kind, []):
+            source_kind = self._source_kind(kind, camera_id)
+            version = (source_kind, hub.get_version(source_kind, camera_id))
+            if sent_versions.get(camera_id) == version:
+                continue
+            if now < self.next_send_at.get((kind, camera_id), 0.0):
+                continue
+            changed[camera_id] = version
+        return changed
+
+    def _throttle(self, kind: str, camera_id):
+        """Запоминает, когда камеру можно отправить снова по частоте её уровня качества."""
+        tier = self._tier(kind, camera_id)
+        if tier and tier.get("fps"):
+            self.next_send_at[(kind, camera_id)] = time.monotonic() + 1.0 / tier["fps"]
+
+    def _camera_item(self, kind: str, camera_id):
+        """
+        Данные камеры в виде, готовом к отправке по протоколу клиента:
+        (вид данных в redis, версия, бинарное сообщение / тело для конверта / словарь) или None.
+        """
+        hub = type(self)._hub
+        source_kind = self._source_kind(kind, camera_id)
+
+        if self.protocol == BINARY_PROTOCOL and source_kind in BINARY_KIND_CODES:
+            item = get_image_message(hub, source_kind, camera_id)
+        elif source_kind in WEBSOCKET_RAW_PASSTHROUGH_KINDS and not self._is_delta(kind):
+            # байты из redis вклеиваются в конверт без json.loads/json.dumps
+            item = hub.get_body(source_kind, camera_id)
+        else:
+            redis_data = hub.get(source_kind, camera_id)
+            item = redis_data[next(iter(redis_data))] if redis_data else None
+
+        return (source_kind, hub.get_version(source_kind, camera_id), item) if item else None
+
+    def _is_body(self, kind: str, source_kind: str) -> bool:
+        """Данные вида source_kind в очереди - готовое тело для конверта, а не словарь."""
+        # для отправки изменениями данные камер всегда словари (см. _camera_item)
+        if self._is_delta(kind):
+            return False
+        return source_kind == MOSAIC_KIND or source_kind in WEBSOCKET_RAW_PASSTHROUGH_KINDS
+
+    async def _flush(self, items: Dict[Tuple[str, Any], Any]) -> int:
+        """
+        Отправляет накопленные в очереди данные камер: по одному текстовому сообщению
+        {"data": {...}} на вид данных или по бинарному сообщению на камеру.
+        Возвращает число отправленных сообщений.
+        """
+        by_kind: Dict[str, list] = {}
+        for (kind, camera_id), item in items.items():
+            by_kind.setdefault(kind, []).append((camera_id, *item))
+
+        sent = 0
+        for kind, kind_items in by_kind.items():
+            message_kind = kind if self.is_multi_stream else None
+
+            text_items = []
+            for camera_id, source_kind, version, item in kind_items:
+                if self.protocol == BINARY_PROTOCOL and source_kind in BINARY_KIND_CODES:
+                    await self.send(bytes_data=item)
+                    sent += 1
+                else:
+                    text_items.append((camera_id, source_kind, version, item))
+            if not text_items:
+                continue
+
+            if self._is_delta(kind):
+                text_items, patch = self._split_delta(kind, text_items)
+                if patch:
+                    message = json.dumps({"kind": message_kind, "patch": patch} if message_kind else {"patch": patch})
+                    await self._send_text(kind, message)
+                    sent += 1
+                if not text_items:
+                    continue
+
+            if (kind, MOSAIC_KIND) in items:
+                # тело мозаики уже общее для набора камер (MosaicBuilder), а слот мозаики
+                # в очереди один на любые камеры - общий кэш перепутал бы разные мозаики
+                message = self._build_message(kind, text_items, message_kind)
+            else:
+                # клиенты с теми же камерами и версиями получают уже собранное сообщение
+                versions = tuple((camera_id, source_kind, version)
+                                 for camera_id, source_kind, version, _item in text_items)
+                message = EnvelopeCache().get(kind, message_kind, versions,
+                                              lambda: self._build_message(kind, text_items, message_kind))
+            await self._send_text(kind, message)
+            sent += 1
+        return sent
+
+    def _split_delta(self, kind: str, text_items: list) -> Tuple[list, dict]:
+        """
+        Делит данные камер на те, что уходят полным снимком, и общий merge patch
+        для остальных. Патч считается в момент отправки от последнего отправленного
+        клиенту состояния камеры, поэтому заменённые в очереди данные ничего не ломают.
+        """
+        snapshots = []
+        patch = {}
+        for camera_id, source_kind, version, camera_data in text_items:
+            previous = self.delta_state.get((kind, camera_id))
+            camera_patch = merge_patch_diff(previous, camera_data) if previous is not None else None
+            # данные из общего кэша не изменяются, поэтому хранится ссылка, а не копия
+            self.delta_state[(kind, camera_id)] = camera_data
+            if camera_patch is None:
+                snapshots.append((camera_id, source_kind, version, camera_data))
+            else:
+                patch.update(camera_patch)
+        return snapshots, patch
+
+    async def _send_text(self, kind: str, message: str):
+        # сжимается уже общее сообщение: контекст сжатия у каждого соединения свой
+        if (self.compressor and kind in WEBSOCKET_COMPRESSION_KINDS
+                and len(message) >= WEBSOCKET_COMPRESSION_MIN_SIZE):
+            await self.send(bytes_data=self.compressor.compress(message))
+        else:
+            await self.send(text_data=message)
+
+    def _build_message(self, kind: str, text_items: list, message_kind: Optional[str]) -> str:
+        """Текстовое сообщение {"data": {...}} из данных камер одного вида."""
+        if any(self._is_body(kind, source_kind) for _camera_id, source_kind, _version, _item in text_items):
+            # в одном сообщении могут оказаться кадры и миниатюры разных уровней качества
+            bodies = [item if self._is_body(kind, source_kind) else body_from_parsed({"": item})
+                      for _camera_id, source_kind, _version, item in text_items]
+            return build_data_envelope(bodies, message_kind).decode("utf-8")
+
+        latest_data = {}
+        for _camera_id, _source_kind, _version, camera_data in text_items:
+            latest_data.update(camera_data)
+        envelope = {"kind": message_kind, "data": latest_data} if message_kind else {"data": latest_data}
+        return json.dumps(envelope)
+
+    async def _get_and_send_data(self):
+        hub = type(self)._hub
+        if not hub:
+            logging.error(f"{self.name} Redis сервис не инициализирован")
+            return
+
+        interval = GET_DATA_FROM_REDIS_TO_SOCKET_SLEEP_TIME
+        logging.info(f"{self.name} Запуск получения данных для клиента {self.client_id}, камеры: {self.camera_lists}")
+
+        metrics = {
+            'skipped_messages': 0,
+            'sent_messages': 0,
+            'last_metrics_log': time.time(),
+            'start_time': time.time()
+        }
+
+        last_tick = hub.tick
+        last_tier_check = time.time()
+        while self.is_running:
+            try:
+                if not self.hub_keys:
+                    await asyncio.sleep(interval)
+                    continue
+
+                # ждём свежий тик общего опросчика вместо собственного опроса redis
+                last_tick = await hub.wait_for_tick(last_tick)
+
+                # отправляем только камеры, у которых появились новые данные
+                queued = 0
+                for kind in list(self.camera_lists):
+                    if kind == "thumbnail" and self.mosaic:
+                        queued += await self._queue_mosaic()
+                        continue
+                    changed = self._changed_cameras(kind)
+                    for camera_id in changed:
+                        item = self._camera_item(kind, camera_id)
+                        if item:
+                            # не отправленные ещё данные камеры заменяются свежими
+                            self.outbox.put((kind, camera_id), item)
+                            self._throttle(kind, camera_id)
+                            queued += 1
+                    self.sent_versions.setdefault(kind, {}).update(changed)
+
+                # уровень качества подстраивается под то, сколько клиент успевает принять
+                if time.time() - last_tier_check >= WEBSOCKET_TIER_ADAPT_INTERVAL:
+                    last_tier_check = time.time()
+                    if self._adapt_tier():
+                        await self._sync_hub_subscription()
+
+                if queued:
+                    metrics['sent_messages'] += 1
+                    logging.debug(f"{self.name} Свежие данные поставлены в очередь клиента {self.client_id}")
+                else:
+                    metrics['skipped_messages'] += 1
+                    logging.debug(f"{self.name} Нет новых данных для клиента {self.client_id}")
+
+                # Логируем метрики каждые 10 секунд
+                current_time = time.time()
+                if current_time - metrics['last_metrics_log'] >= 10:
+                    uptime = current_time - metrics['start_time']
+                    avg_send_rate = metrics['sent_messages'] / uptime if uptime > 0 else 0
+                    skip_ratio = (metrics['skipped_messages'] /
+                                  (metrics['sent_messages'] + metrics['skipped_messages']) * 100
+                                  if metrics['sent_messages'] + metrics['skipped_messages'] > 0 else 0)
+
+                    outbox_metrics = self.outbox.metrics()
+                    cache_metrics = EnvelopeCache().metrics()
+                    logging.info(
+                        f"{self.name} Метрики клиента {self.client_id}:\n"
+                        f"  ├─ Время работы: {uptime:.1f} сек\n"
+                        f"  ├─ Отправлено: {metrics['sent_messages']}\n"
+                        f"  ├─ Пропущено: {metrics['skipped_messages']}\n"
+                        f"  ├─ Частота отправки: {avg_send_rate:.1f} сообщ/сек\n"
+                        f"  ├─ Процент пропусков: {skip_ratio:.1f}%\n"
+                        f"  ├─ Заменено в очереди: {outbox_metrics['dropped']}\n"
+                        f"  ├─ Задержка в очереди: средняя {outbox_metrics['avg_lag'] * 1000:.1f} мс, "
+                        f"макс {outbox_metrics['max_lag'] * 1000:.1f} мс\n"
+                        f"  ├─ Общий кэш сообщений: попаданий {cache_metrics['hits']}, "
+                        f"сборок {cache_metrics['misses']}\n"
+                        f"  ├─ Сжатие: {self.compressor.ratio * 100 if self.compressor else 100:.1f}% от исходного\n"
+                        f"  └─ Без подтверждения: {outbox_metrics['in_flight']}"
+                    )
+                    metrics['last_metrics_log'] = current_time
+
+            except asyncio.CancelledError:
+                uptime = time.time() - metrics['start_time']
+                logging.info(
+                    f"{self.name} Остановка клиента {self.client_id}. Итоговые метрики:\n"
+                    f"  ├─ Время работы: {uptime:.1f} сек\n"
+                    f"  ├─ Всего отправлено: {metrics['sent_messages']}\n"
+                    f"  └─ Всего пропущено: {metrics['skipped_messages']}"
+                )
+                break
+            except Exception as e:
+                logging.error(f"{self.name} Ошибка получения/отправки данных для клиента {self.client_id}: {e}")
+                self.is_running = False
+                break
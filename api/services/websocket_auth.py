@@ -0,0 +1,61 @@
+from typing import Optional
+from urllib.parse import parse_qs
+
+
+# Разбор рукопожатия websocket, общий для сокетов и WebSocketAuthMiddleware.
+# Заголовки просматриваются до первого совпадения, без сборки словаря всех заголовков,
+# а нужная cookie ищется в заголовке Cookie без разбора остальных cookies.
+
+ACCESS_TOKEN_COOKIE = "access_token"
+
+
+def get_header(scope, name: bytes) -> Optional[bytes]:
+    """Значение заголовка рукопожатия (имя в нижнем регистре, как в ASGI) или None."""
+    for header_name, value in scope.get("headers", ()):
+        if header_name == name:
+            return value
+    return None
+
+
+def find_cookie(cookie_header: bytes, name: str) -> Optional[str]:
+    """Значение cookie из заголовка Cookie; остальные cookies не разбираются."""
+    prefix = name.encode("latin-1") + b"="
+    start = 0
+    while True:
+        index = cookie_header.find(prefix, start)
+        if index < 0:
+            return None
+        # имя должно начинаться с начала заголовка или после разделителя, а не внутри другого имени
+        if index == 0 or cookie_header[index - 1] in b"; ":
+            value_start = index + len(prefix)
+            value_end = cookie_header.find(b";", value_start)
+            value = cookie_header[value_start:value_end] if value_end >= 0 else cookie_header[value_start:]
+            return value.decode("utf-8", "replace")
+        start = index + 1
+
+
+def get_cookie(scope, name: str) -> Optional[str]:
+    """
+    Значение cookie рукопожатия. Если CookieMiddleware (AuthMiddlewareStack) уже разобрал
+    cookies в scope["cookies"], берётся оттуда, иначе ищется в заголовке Cookie.
+    """
+    cookies = scope.get("cookies")
+    if cookies is not None:
+        return cookies.get(name)
+    cookie_header = get_header(scope, b"cookie")
+    if not cookie_header:
+        return None
+    return find_cookie(cookie_header, name)
+
+
+def get_access_token(scope) -> Optional[str]:
+    """JWT access токен из cookie рукопожатия."""
+    return get_cookie(scope, ACCESS_TOKEN_COOKIE)
+
+
+def get_query_param(scope, name: str) -> Optional[str]:
+    """Параметр строки запроса рукопожатия. Строка разбирается, только если в ней есть имя параметра."""
+    query_string = scope.get("query_string", b"")
+    if name.encode("latin-1") + b"=" not in query_string:
+        return None
+    return parse_qs(query_string.decode("utf8")).get(name, [None])[0]
@@ -1,3 +1,448 @@
-from django.test import TestCase
+import asyncio
+import base64
+import json
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import fakeredis
+import fakeredis.aioredis
+from django.contrib.auth.models import User
+from django.db import OperationalError
+from django.test import TestCase, SimpleTestCase
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken
+
+from api.configs.app import (
+    ALERT_STREAM_KEY,
+    ALERT_STREAM_GROUP,
+    ALERT_STREAM_DEAD_LETTER_KEY,
+    REDIS_HUB_UPDATES_CHANNEL,
+)
+from api.metaclasses.singletone import Singletone
+from api.models import Camera, AlertData
+from api.services import alert_stream, redis_hub, auth_for_frame_processor
+from api.services.alert_stream import AlertStreamWriter, enqueue_alert
+from api.services.async_redis import AsyncRedisService
+from api.services.redis_hub import RedisPollerHub
+from api.views import alerts as alert_views
+
+
+def new_instance(cls, *args):
+    """Отдельный экземпляр класса-синглтона для теста."""
+    return super(Singletone, cls).__call__(*args)
+
+
+async def wait_until(predicate, timeout: float = 2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not predicate():
+        if asyncio.get_running_loop().time() > deadline:
+            raise AssertionError("условие не выполнилось за отведённое время")
+        await asyncio.sleep(0.01)
+
+
+class AlertStreamWriterTests(TestCase):
+    """Запись тревог из redis stream в бд, redis - fakeredis."""
+
+    def setUp(self):
+        self.redis_client = fakeredis.FakeRedis()
+        self.camera = Camera.objects.create(camera_ip="10.0.0.1", camera_number=1)
+
+    def writer(self, **kwargs):
+        writer = AlertStreamWriter(self.redis_client, "test-writer", block_ms=0, **kwargs)
+        writer.ensure_group()
+        return writer
+
+    def enqueue(self, key=None, **fields):
+        return enqueue_alert(self.redis_client, dict({"camera_id": self.camera.id, "message": {"class": "person"}}, **fields), key)
+
+    def pending(self) -> int:
+        return self.redis_client.xpending(ALERT_STREAM_KEY, ALERT_STREAM_GROUP)["pending"]
+
+    def test_enqueue_drain_ack(self):
+        first, _ = self.enqueue("key-1")
+        second, _ = self.enqueue()
+
+        self.writer().run(once=True)
+
+        self.assertEqual(set(AlertData.objects.values_list("idempotency_key", flat=True)), {first, second})
+        self.assertEqual(self.pending(), 0)
+
+    def test_failed_batch_is_redelivered(self):
+        self.enqueue("key-1")
+        writer = self.writer(claim_idle_ms=0)
+
+        # бд недоступна: пачка остаётся неподтверждённой
+        with mock.patch.object(alert_stream, "create_alerts_bulk", side_effect=OperationalError("down")):
+            with self.assertRaises(OperationalError):
+                writer.process_batch(block=False)
+        self.assertEqual(self.pending(), 1)
+        self.assertFalse(AlertData.objects.exists())
+
+        # XAUTOCLAIM возвращает запись, после записи она подтверждается
+        self.assertEqual(writer.process_batch(block=False), 1)
+        self.assertEqual(AlertData.objects.get().idempotency_key, "key-1")
+        self.assertEqual(self.pending(), 0)
+
+    def test_duplicate_key_is_skipped(self):
+        self.enqueue("key-1")
+        writer = self.writer()
+        writer.run(once=True)
+
+        # повтор доставки и повтор в одной пачке не создают вторую тревогу
+        self.enqueue("key-1")
+        self.enqueue("key-1")
+        writer.run(once=True)
+
+        self.assertEqual(AlertData.objects.filter(idempotency_key="key-1").count(), 1)
+        self.assertEqual(writer.duplicates, 1)
+        self.assertEqual(self.pending(), 0)
+
+    def test_poison_entry_moves_to_dead_letter(self):
+        for index in range(3):
+            self.enqueue(f"key-{index}")
+        self.enqueue("poison", message="\u0000")
+        create_alerts_bulk = alert_stream.create_alerts_bulk
+
+        def reject_nul(alerts, **kwargs):
+            # так ведёт себя postgres на \u0000 в строке
+            if any(alert.message == "\u0000" for alert in alerts):
+                raise ValueError("A string literal cannot contain NUL (0x00) characters.")
+            return create_alerts_bulk(alerts, **kwargs)
+
+        writer = self.writer(claim_idle_ms=0, max_deliveries=2)
+        with mock.patch.object(alert_stream, "create_alerts_bulk", side_effect=reject_nul):
+            writer.process_batch(block=False)
+            # остальные тревоги пачки записаны, отравленная ждёт повторной доставки
+            self.assertEqual(AlertData.objects.count(), 3)
+            self.assertEqual(self.pending(), 1)
+
+            writer.process_batch(block=False)
+
+        self.assertEqual(self.pending(), 0)
+        self.assertEqual(self.redis_client.xlen(ALERT_STREAM_DEAD_LETTER_KEY), 1)
+        self.assertFalse(AlertData.objects.filter(idempotency_key="poison").exists())
+
+
+@mock.patch.object(redis_hub, "GET_DATA_FROM_REDIS_TO_SOCKET_SLEEP_TIME", 0.01)
+@mock.patch.object(redis_hub, "REDIS_HUB_PUSH_COALESCE_TIME", 0)
+class RedisPollerHubTests(SimpleTestCase):
+    """Общий опросчик redis в режимах poll и push, redis - fakeredis."""
+
+    def hub(self, push: bool):
+        self.redis_client = fakeredis.aioredis.FakeRedis()
+        redis_service = new_instance(AsyncRedisService)
+        redis_service.redis_client = self.redis_client
+        hub = new_instance(RedisPollerHub, redis_service)
+        hub._push_enabled = push
+        hub._remote_by_default = False
+        return hub
+
+    async def stop(self, hub):
+        for task in (hub._poll_task, hub._listen_task):
+            if task is not None:
+                task.cancel()
+        await asyncio.gather(*(task for task in (hub._poll_task, hub._listen_task) if task), return_exceptions=True)
+        await self.redis_client.aclose()
+
+    @mock.patch.object(redis_hub, "REDIS_HUB_FALLBACK_POLL_INTERVAL", 30)
+    async def test_publish_wakes_push_hub(self):
+        hub = self.hub(push=True)
+        try:
+            hub.subscribe("frame", [1])
+            await wait_until(lambda: hub._push_active and hub.get_version("frame", 1))
+
+            await self.redis_client.set("only_frame_data_1", b'{"1": {"frame": "a"}}')
+            await self.redis_client.publish(REDIS_HUB_UPDATES_CHANNEL, "only_frame_data_1")
+            # страховочный опрос - раз в 30 секунд, данные могло принести только уведомление
+            await wait_until(lambda: hub.get("frame", 1) == {"1": {"frame": "a"}})
+        finally:
+            await self.stop(hub)
+
+    def test_keyspace_notification_marks_key_dirty(self):
+        hub = self.hub(push=True)
+        hub._redis_key_index["only_frame_data_1"] = ("frame", 1)
+
+        hub._on_push_message({"type": "pmessage", "channel": b"__keyspace@0__:only_frame_data_1", "data": b"set"})
+        hub._on_push_message({"type": "pmessage", "channel": b"__keyspace@0__:only_frame_data_2", "data": b"set"})
+
+        self.assertEqual(hub._dirty, {("frame", 1)})
+        self.assertTrue(hub._get_wakeup().is_set())
+
+    async def test_poll_without_notifications(self):
+        hub = self.hub(push=False)
+        try:
+            hub.subscribe("alert", [1])
+            await self.redis_client.set("only_alert_status_data_1", b'{"1": {"alert": true}}')
+            await wait_until(lambda: hub.get("alert", 1) == {"1": {"alert": True}})
+            self.assertFalse(hub._push_active)
+        finally:
+            await self.stop(hub)
+
+    @mock.patch.object(redis_hub, "REDIS_HUB_FALLBACK_POLL_INTERVAL", 0.1)
+    async def test_push_hub_falls_back_to_poll_when_notification_is_lost(self):
+        hub = self.hub(push=True)
+        try:
+            hub.subscribe("frame", [1])
+            await wait_until(lambda: hub._push_active and hub.get_version("frame", 1))
+
+            # значение изменилось без уведомления
+            await self.redis_client.set("only_frame_data_1", b'{"1": {"frame": "b"}}')
+            await wait_until(lambda: hub.get("frame", 1) == {"1": {"frame": "b"}})
+        finally:
+            await self.stop(hub)
+
+    async def test_unsubscribe_stops_delivery(self):
+        hub = self.hub(push=True)
+        try:
+            await self.redis_client.set("only_frame_data_1", b'{"1": {"frame": "a"}}')
+            hub.subscribe("frame", [1])
+            await wait_until(lambda: hub._push_active and hub.get("frame", 1) is not None)
+
+            hub.unsubscribe("frame", [1])
+            await self.redis_client.set("only_frame_data_1", b'{"1": {"frame": "b"}}')
+            await self.redis_client.publish(REDIS_HUB_UPDATES_CHANNEL, "only_frame_data_1")
+            await asyncio.sleep(0.2)
+
+            self.assertEqual(hub.subscribed_keys(), [])
+            self.assertIsNone(hub.get("frame", 1))
+            self.assertEqual(hub.get_version("frame", 1), 0)
+        finally:
+            await self.stop(hub)
+
+
+@mock.patch.object(auth_for_frame_processor, "ALLOWED_TOKENS_FOR_FRAME_PROCESSOR", ["test-token"])
+class AlertCreateTests(TestCase):
+    """Запись тревог кадровыми процессорами: по одной и пакетом."""
+
+    def setUp(self):
+        self.camera = Camera.objects.create(camera_ip="10.0.0.1", camera_number=1)
+
+    def post(self, url, body):
+        return self.client.post(url, body, content_type="application/json", secure=True,
+                                HTTP_AUTHORIZATION="Token test-token")
+
+    def alert(self, **fields):
+        return dict({"camera_id": self.camera.id, "message": {"class": "person"}}, **fields)
+
+    def test_bulk_partial_success(self):
+        response = self.post("/api/v1/alerts/bulk/", [
+            self.alert(),
+            {"message": {}},
+            self.alert(camera_id=999),
+            self.alert(first_detection_datetime="вчера"),
+            self.alert(idempotency_key=["list"]),
+            self.alert(idempotency_key="x" * 65),
+            "alert",
+            self.alert(idempotency_key="key-1"),
+        ])
+
+        self.assertEqual(response.status_code, 201)
+        results = response.json()["results"]
+        self.assertEqual(response.json()["created"], 2)
+        self.assertEqual([sorted(result) for result in results],
+                         [["id", "number"]] + [["error"]] * 6 + [["id", "number"]])
+        self.assertEqual(AlertData.objects.count(), 2)
+
+    def test_bulk_all_rejected(self):
+        response = self.post("/api/v1/alerts/bulk/", [self.alert(camera_id=999)])
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(AlertData.objects.exists())
+
+    def test_bulk_numbers_follow_request_order(self):
+        response = self.post("/api/v1/alerts/bulk/", [
+            self.alert(idempotency_key="key-1"), self.alert(), self.alert(idempotency_key="key-2"), self.alert(),
+        ])
+
+        numbers = [result["number"] for result in response.json()["results"]]
+        self.assertEqual(numbers, sorted(numbers))
+        self.assertEqual(len(set(numbers)), 4)
+
+    def test_bulk_replay_returns_stored_alerts(self):
+        first = self.post("/api/v1/alerts/bulk/", [self.alert(idempotency_key="key-1"), self.alert()]).json()
+
+        # повтор пакета: каждый alert с записанным ключом возвращает записанную строку
+        response = self.post("/api/v1/alerts/bulk/", [
+            self.alert(idempotency_key="key-1"), self.alert(idempotency_key="key-1"),
+        ])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["created"], 0)
+        results = response.json()["results"]
+        self.assertEqual(results, [first["results"][0]] * 2)
+        self.assertEqual(AlertData.objects.count(), 2)
+
+    def test_bulk_concurrent_key_reports_stored_alert(self):
+        create = alert_views.AlertDataBulkView._create
+
+        def racing(alerts):
+            # параллельный запрос записал тот же ключ между проверкой и вставкой
+            AlertData.objects.create(camera=self.camera, number=100, message={}, idempotency_key="key-1")
+            return create(alerts)
+
+        with mock.patch.object(alert_views.AlertDataBulkView, "_create", staticmethod(racing)):
+            response = self.post("/api/v1/alerts/bulk/", [self.alert(idempotency_key="key-1"), self.alert()])
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()["created"], 1)
+        self.assertEqual(response.json()["results"][0]["number"], 100)
+        self.assertEqual(AlertData.objects.count(), 2)
+
+    def test_replay_with_same_key(self):
+        first = self.post("/api/v1/alerts/", self.alert(idempotency_key="key-1"))
+        second = self.post("/api/v1/alerts/", self.alert(idempotency_key="key-1"))
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.json()["id"], first.json()["id"])
+
+    def test_concurrent_same_key_returns_stored_alert(self):
+        create_alert_safely = alert_views.create_alert_safely
+
+        def racing(**kwargs):
+            stored = AlertData.objects.create(camera=self.camera, number=100, message={}, idempotency_key="key-1")
+            self.stored_id = stored.id
+            return create_alert_safely(**kwargs)
+
+        with mock.patch.object(alert_views, "create_alert_safely", side_effect=racing):
+            response = self.post("/api/v1/alerts/", self.alert(idempotency_key="key-1"))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["id"], self.stored_id)
+        self.assertEqual(AlertData.objects.count(), 1)
+
+    def test_key_must_be_a_string(self):
+        response = self.post("/api/v1/alerts/", self.alert(idempotency_key={"key": 1}))
+        self.assertEqual(response.status_code, 400)
+
+
+class AlertListTestCase(TestCase):
+    """Список тревог под JWT из cookie."""
+
+    def setUp(self):
+        self.camera = Camera.objects.create(camera_ip="10.0.0.1", camera_number=1)
+        user = User.objects.create_user(username="operator", password="password")
+        self.client.cookies["access_token"] = str(AccessToken.for_user(user))
+
+    def create_alerts(self, count: int, created_at=None, **fields) -> list:
+        fields = dict({"camera": self.camera, "message": {"class": "person"}}, **fields)
+        alerts = [AlertData.objects.create(**fields) for _ in range(count)]
+        if created_at is not None:
+            AlertData.objects.filter(id__in=[alert.id for alert in alerts]).update(created_at=created_at)
+        return [alert.id for alert in alerts]
+
+    def get(self, url: str, **params):
+        return self.client.get(url, params, secure=True)
+
+    def pages(self, **params) -> list:
+        """id тревог всех страниц курсорной пагинации по ссылкам next."""
+        ids = []
+        response = self.get("/api/v1/alerts/", pagination="cursor", **params)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            ids += [alert["id"] for alert in response.json()["results"]]
+            if response.json()["next"] is None:
+                return ids
+            response = self.get(response.json()["next"])
+
+    @staticmethod
+    def cursor(value) -> str:
+        return base64.urlsafe_b64encode(json.dumps(value).encode()).decode()
+
+
+class AlertKeysetPaginationTests(AlertListTestCase):
+
+    def test_pages_over_tied_created_at(self):
+        now = timezone.now()
+        older = self.create_alerts(3, created_at=now - timedelta(minutes=1))
+        tied = self.create_alerts(5, created_at=now)
+
+        # тревоги с одинаковым created_at разделяет id: ни одна не теряется и не повторяется
+        self.assertEqual(self.pages(limit=2), sorted(tied, reverse=True) + sorted(older, reverse=True))
+
+    def test_count(self):
+        self.create_alerts(3)
+        response = self.get("/api/v1/alerts/", pagination="cursor", limit=2, count="true")
+        self.assertEqual(response.json()["count"], 3)
+        self.assertNotIn("count", self.get("/api/v1/alerts/", pagination="cursor").json())
+
+    def test_invalid_cursor(self):
+        for cursor in ("???", "bm90LWpzb24=", self.cursor(5), self.cursor({}), self.cursor(["вчера", 1]),
+                       self.cursor([timezone.now().isoformat(), "abc"]), self.cursor([timezone.now().isoformat()])):
+            with self.subTest(cursor=cursor):
+                response = self.get("/api/v1/alerts/", cursor=cursor)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn("cursor", response.json()["error"])
+
+    @mock.patch.object(alert_views, "ALERT_CURSOR_MAX_LIMIT", 3)
+    def test_limit_is_clamped(self):
+        self.create_alerts(5)
+        for limit, expected in (("0", 1), ("-5", 1), ("2", 2), ("100000", 3)):
+            with self.subTest(limit=limit):
+                response = self.get("/api/v1/alerts/", pagination="cursor", limit=limit)
+                self.assertEqual(len(response.json()["results"]), expected)
+
+    def test_invalid_limit(self):
+        response = self.get("/api/v1/alerts/", pagination="cursor", limit="many")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("limit", response.json()["error"])
+
+
+class AlertFilterTests(AlertListTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.other_camera = Camera.objects.create(camera_ip="10.0.0.2", camera_number=2)
+        self.now = timezone.now()
+
+    def alerts(self, **params) -> set:
+        response = self.get("/api/v1/alerts/", limit=100, **params)
+        self.assertEqual(response.status_code, 200)
+        return {alert["id"] for alert in response.json()["results"]}
+
+    def test_camera(self):
+        first = self.create_alerts(2)
+        second = self.create_alerts(1, camera=self.other_camera)
+
+        self.assertEqual(self.alerts(camera=str(self.camera.id)), set(first))
+        self.assertEqual(self.alerts(camera=f"{self.camera.id},{self.other_camera.id}"), set(first + second))
+
+    def test_detection_datetime_range(self):
+        old = self.create_alerts(1, first_detection_datetime=self.now - timedelta(hours=2),
+                                 last_detection_datetime=self.now - timedelta(hours=2))
+        recent = self.create_alerts(1, first_detection_datetime=self.now - timedelta(minutes=5),
+                                    last_detection_datetime=self.now)
+        hour_ago = (self.now - timedelta(hours=1)).isoformat()
+
+        self.assertEqual(self.alerts(first_detection_after=hour_ago), set(recent))
+        self.assertEqual(self.alerts(first_detection_before=hour_ago), set(old))
+        # after включительно, before - нет
+        self.assertEqual(self.alerts(last_detection_after=self.now.isoformat()), set(recent))
+        self.assertEqual(self.alerts(last_detection_before=self.now.isoformat()), set(old))
+
+    def test_class(self):
+        person = self.create_alerts(1)
+        car = self.create_alerts(1, message={"class": "car"})
+        numeric = self.create_alerts(1, message={"class": 2})
+
+        self.assertEqual(self.alerts(**{"class": "person"}), set(person))
+        self.assertEqual(self.alerts(**{"class": "person,car"}), set(person + car))
+        self.assertEqual(self.alerts(**{"class": "2"}), set(numeric))
+
+    def test_combined_filters_with_cursor(self):
+        expected = self.create_alerts(5, first_detection_datetime=self.now)
+        self.create_alerts(2, message={"class": "car"}, first_detection_datetime=self.now)
+        self.create_alerts(2, camera=self.other_camera, first_detection_datetime=self.now)
+        self.create_alerts(2, first_detection_datetime=self.now - timedelta(days=1))
+
+        ids = self.pages(limit=2, camera=str(self.camera.id), first_detection_after=self.now.isoformat(),
+                         **{"class": "person"})
+        # фильтры сохраняются в ссылке next
+        self.assertEqual(ids, sorted(expected, reverse=True))
+
+    def test_malformed_values(self):
+        for param, value in (("camera", "1,a"), ("first_detection_after", "вчера"),
+                             ("last_detection_before", "2024-13-45T00:00:00")):
+            with self.subTest(param=param):
+                response = self.get("/api/v1/alerts/", **{param: value})
+                self.assertEqual(response.status_code, 400)
+                self.assertIn(param, response.json()["error"])
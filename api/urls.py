@@ -14,6 +14,7 @@ from api.views.cameras import (
 
 from api.views.alerts import (
     AlertDataView,
+    AlertDataBulkView,
     AlertDataDetailView
 )
 
@@ -52,6 +53,7 @@ urlpatterns = [
 
 
     path('alerts/', AlertDataView.as_view(), name='alerts'),  # GET, POST
+    path('alerts/bulk/', AlertDataBulkView.as_view(), name='alerts-bulk'),  # POST
     path('alerts/<int:pk>/', AlertDataDetailView.as_view(), name='alert-detail'),  # GET, PUT, PATCH, DELETE
 
 
@@ -9,14 +9,41 @@ from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.pagination import LimitOffsetPagination, BasePagination
+from rest_framework.exceptions import ValidationError
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param, remove_query_param
 from rest_framework import status
 
+from django.db import connection, transaction, IntegrityError
+from django.db.models import Q
 from django.http import Http404
+from django.utils.dateparse import parse_datetime
+
+import json
+import base64
+import binascii
 
 from api.serializers.serializers import AlertDataSerializer
 from api.services.auth_for_frame_processor import CustomTokenAuthentication
-from api.services.postgres_db import create_alert_safely
+from api.configs.app import (
+    ALERT_BULK_MAX_ITEMS,
+    ALERT_INGESTION_MODE,
+    ALERT_PAGINATION_MODE,
+    ALERT_CURSOR_MAX_LIMIT,
+    ALERT_MESSAGE_CLASS_FIELD,
+)
+from api.services.postgres_db import (
+    create_alert_safely,
+    create_alerts_bulk,
+    assign_alert_numbers,
+    cameras_for_alerts,
+    build_alert,
+    IDEMPOTENCY_KEY_MAX_LENGTH,
+)
+from api.services.jwt_cache import VerifiedTokenCache
+from api.services.alert_stream import enqueue_alert
+from api.services.redis import RedisService
 
 from api.models import AlertData, Camera
 
@@ -27,7 +54,8 @@ class CookieJWTAuthentication(JWTAuthentication):
         if raw_token is None:
             return None
         try:
-            validated_token = self.get_validated_token(raw_token)
+            # подпись проверяется один раз на токен, дальше до exp он берётся из кэша
+            validated_token = VerifiedTokenCache().validate(raw_token)
             return self.get_user(validated_token), validated_token
         except Exception as e:
             logging.warning(f"Ошибка аутентификации по cookie: {e}")
@@ -43,9 +71,78 @@ class GetRequiresJWTPermission(BasePermission):
         return False
 
 
+class AlertKeysetPagination(BasePagination):
+    """
+    Курсорная пагинация тревог по (created_at, id), от новых к старым.
+
+    Курсор - последняя отданная тревога, следующая страница начинается строго после
+    неё: WHERE (created_at, id) < (курсор) ORDER BY created_at DESC, id DESC LIMIT n
+    по индексу alert_created_id_idx. Без OFFSET и COUNT(*) страница в глубине истории
+    стоит столько же, сколько первая. Общее число тревог считается только по count=true.
+    """
+    cursor_query_param = "cursor"
+    limit_query_param = "limit"
+    count_query_param = "count"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.limit = self._get_limit(request)
+        self.count = queryset.count() if request.query_params.get(self.count_query_param) == "true" else None
+
+        position = self._decode_cursor(request.query_params.get(self.cursor_query_param))
+        if position is not None:
+            created_at, pk = position
+            # created_at <= c даёт границу сканирования индекса, вторая часть отсекает уже отданные
+            queryset = queryset.filter(Q(created_at__lte=created_at) & (Q(created_at__lt=created_at) | Q(id__lt=pk)))
+
+        page = list(queryset.order_by('-created_at', '-id')[:self.limit + 1])
+        self.next_position = (page[self.limit - 1].created_at, page[self.limit - 1].id) if len(page) > self.limit else None
+        return page[:self.limit]
+
+    def get_paginated_response(self, data):
+        response = {"next": self._get_next_link(), "results": data}
+        if self.count is not None:
+            response = {"count": self.count, **response}
+        return Response(response)
+
+    def _get_limit(self, request) -> int:
+        try:
+            limit = int(request.query_params.get(self.limit_query_param, api_settings.PAGE_SIZE or 100))
+        except ValueError:
+            raise ValidationError({self.limit_query_param: "Ожидается целое число"})
+        return max(1, min(limit, ALERT_CURSOR_MAX_LIMIT))
+
+    def _get_next_link(self):
+        if self.next_position is None:
+            return None
+        created_at, pk = self.next_position
+        cursor = base64.urlsafe_b64encode(json.dumps([created_at.isoformat(), pk]).encode()).decode()
+        url = remove_query_param(self.request.build_absolute_uri(), "offset")
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def _decode_cursor(self, cursor):
+        if not cursor:
+            return None
+        try:
+            created_at, pk = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            created_at = parse_datetime(created_at)
+            if created_at is None:
+                raise ValueError
+            return created_at, int(pk)
+        except (binascii.Error, TypeError, ValueError):
+            raise ValidationError({self.cursor_query_param: "Неверный курсор"})
+
+
 class AlertDataView(APIView, LimitOffsetPagination):
     serializer_class = AlertDataSerializer
     permission_classes = [GetRequiresJWTPermission]
+    # параметр запроса -> (поле, lookup) фильтров по времени обнаружения
+    datetime_filters = {
+        "first_detection_after": "first_detection_datetime__gte",
+        "first_detection_before": "first_detection_datetime__lt",
+        "last_detection_after": "last_detection_datetime__gte",
+        "last_detection_before": "last_detection_datetime__lt",
+    }
 
 
     def get_authenticators(self):
@@ -58,7 +155,15 @@ class AlertDataView(APIView, LimitOffsetPagination):
 
     @extend_schema(
         summary="Получить последние тревоги (с пагинацией)",
-        description="Требует JWT-аутентификацию через куки. Возвращает последние alert'ы, отсортированные по дате создания.",
+        description=(
+            "Требует JWT-аутентификацию через куки. Возвращает последние alert'ы, отсортированные по дате создания. "
+            "По умолчанию пагинация limit/offset с count. С параметром pagination=cursor (или cursor) - курсорная: "
+            "{\"next\", \"results\"} без подсчёта всех alert'ов (count=true добавляет count), "
+            "следующая страница - по ссылке next. "
+            "Фильтры: camera (id через запятую), first_detection_after/first_detection_before, "
+            "last_detection_after/last_detection_before (ISO 8601, after включительно), "
+            f"class (значения поля message.{ALERT_MESSAGE_CLASS_FIELD} через запятую)."
+        ),
         responses={
             200: AlertDataSerializer(many=True),
             401: {"description": "Требуется JWT-аутентификация"}
@@ -72,13 +177,23 @@ class AlertDataView(APIView, LimitOffsetPagination):
             )
         try:
             alerts = AlertData.objects.select_related('camera').only(
-                "id", "first_detection_datetime", "last_detection_datetime", "camera_id"
-            ).order_by('-created_at')
+                "id", "first_detection_datetime", "last_detection_datetime", "camera_id", "created_at"
+            ).order_by('-created_at', '-id')
+            alerts = self._filter_alerts(alerts, request.query_params)
+
+            pagination_mode = request.query_params.get("pagination", ALERT_PAGINATION_MODE)
+            if "cursor" in request.query_params or pagination_mode == "cursor":
+                paginator = AlertKeysetPagination()
+                results = paginator.paginate_queryset(alerts, request, view=self)
+                serializer = self.serializer_class(results, many=True)
+                return paginator.get_paginated_response(serializer.data)
 
             results = self.paginate_queryset(alerts, request, view=self)
             serializer = self.serializer_class(results, many=True)
             return self.get_paginated_response(serializer.data)
 
+        except ValidationError as e:
+            return Response({"error": e.detail}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             logging.error(f"Ошибка получения данных: {str(e)}", exc_info=True)
             return Response(
@@ -86,15 +201,61 @@ class AlertDataView(APIView, LimitOffsetPagination):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+    def _filter_alerts(self, alerts, query_params):
+        """Фильтры списка тревог из параметров запроса. ValidationError при неверных значениях."""
+        cameras = query_params.get("camera")
+        if cameras:
+            try:
+                alerts = alerts.filter(camera_id__in=[int(camera_id) for camera_id in cameras.split(",") if camera_id])
+            except ValueError:
+                raise ValidationError({"camera": "Ожидаются id камер через запятую"})
+
+        for param, lookup in self.datetime_filters.items():
+            value = query_params.get(param)
+            if not value:
+                continue
+            try:
+                moment = parse_datetime(value)
+            except ValueError:
+                moment = None
+            if moment is None:
+                raise ValidationError({param: "Ожидается дата и время в ISO 8601"})
+            alerts = alerts.filter(**{lookup: moment})
+
+        classes = [value for value in query_params.get("class", "").split(",") if value]
+        if classes:
+            # класс может храниться и названием, и номером класса модели
+            values = classes + [int(value) for value in classes if value.isdigit()]
+            condition = Q()
+            for value in values:
+                if connection.vendor == "postgresql":
+                    # message @> {...} по GIN индексу; класс может быть строкой или элементом списка
+                    condition |= Q(message__contains={ALERT_MESSAGE_CLASS_FIELD: value})
+                    condition |= Q(message__contains={ALERT_MESSAGE_CLASS_FIELD: [value]})
+                else:
+                    # в SQLite нет contains для JSON, сравнивается только значение-скаляр
+                    condition |= Q(**{f"message__{ALERT_MESSAGE_CLASS_FIELD}": value})
+            alerts = alerts.filter(condition)
+
+        return alerts
+
     @extend_schema(
         summary="Создать новый alert",
-        description="Требует Token в заголовке запроса. Создаёт новый alert, привязывая его к камере.",
+        description=(
+            "Требует Token в заголовке запроса. Создаёт новый alert, привязывая его к камере. "
+            "Ключ повторной доставки передаётся заголовком Idempotency-Key или полем idempotency_key: "
+            "повтор с тем же ключом возвращает уже созданный alert. "
+            "При ALERT_INGESTION_MODE=stream alert только ставится в очередь на запись (202)."
+        ),
         request=AlertDataSerializer,
         responses={
+            200: AlertDataSerializer,
             201: AlertDataSerializer,
+            202: {"description": "Alert поставлен в очередь на запись"},
             400: {"description": "Ошибка запроса"},
             401: {"description": "Отсутствует или неверный Token"},
-            404: {"description": "Камера не найдена"}
+            404: {"description": "Камера не найдена"},
+            503: {"description": "Очередь записи недоступна"}
         }
     )
     def post(self, request):
@@ -109,6 +270,26 @@ class AlertDataView(APIView, LimitOffsetPagination):
                     status=status.HTTP_400_BAD_REQUEST
                 )
 
+            idempotency_key = request.headers.get("Idempotency-Key") or alert_data.get("idempotency_key")
+            if idempotency_key is not None and not isinstance(idempotency_key, str):
+                return Response(
+                    {"error": "idempotency_key должен быть строкой"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            if idempotency_key and len(idempotency_key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+                return Response(
+                    {"error": f"idempotency_key длиннее {IDEMPOTENCY_KEY_MAX_LENGTH} символов"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+            if ALERT_INGESTION_MODE == "stream":
+                return self._enqueue(alert_data, idempotency_key)
+
+            if idempotency_key:
+                existing = AlertData.objects.filter(idempotency_key=idempotency_key).first()
+                if existing:
+                    return Response(self.serializer_class(existing).data, status=status.HTTP_200_OK)
+
             camera = Camera.objects.filter(id=camera_id).first()
             if not camera:
                 logging.warning(f"Ошибка: камера с id={camera_id} не найдена")
@@ -127,8 +308,16 @@ class AlertDataView(APIView, LimitOffsetPagination):
                     message=alert_data.get("message", "No message"),
                     first_detection_datetime=first_detection,
                     last_detection_datetime=last_detection,
-                    image=image_path
+                    image=image_path,
+                    idempotency_key=idempotency_key or None
                 )
+            except IntegrityError:
+                # параллельный запрос с тем же ключом успел записать alert между проверкой и вставкой
+                existing = AlertData.objects.filter(idempotency_key=idempotency_key).first() if idempotency_key else None
+                if existing is None:
+                    logging.error("Ошибка при создании алерта: нарушено ограничение бд", exc_info=True)
+                    return Response({"error": "Ошибка при сохранении данных"}, status=500)
+                return Response(self.serializer_class(existing).data, status=status.HTTP_200_OK)
             except Exception as e:
                 logging.error(f"Ошибка при создании алерта: {str(e)}", exc_info=True)
                 return Response({"error": "Ошибка при сохранении данных"}, status=500)
@@ -143,6 +332,147 @@ class AlertDataView(APIView, LimitOffsetPagination):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+    def _enqueue(self, alert_data, idempotency_key):
+        """Ставит alert в redis stream, в бд его запишет воркер run_alert_writer."""
+        redis_client = RedisService().get_redis_client()
+        if redis_client is None:
+            return Response({"error": "Очередь записи недоступна"}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        try:
+            fields = ("camera_id", "message", "first_detection_datetime", "last_detection_datetime", "image")
+            key, stream_id = enqueue_alert(
+                redis_client,
+                {field: alert_data.get(field) for field in fields if field in alert_data},
+                idempotency_key,
+            )
+        except Exception as e:
+            logging.error(f"Ошибка постановки алерта в очередь: {str(e)}", exc_info=True)
+            return Response({"error": "Очередь записи недоступна"}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        return Response({"idempotency_key": key, "stream_id": stream_id}, status=status.HTTP_202_ACCEPTED)
+
+
+class AlertDataBulkView(APIView):
+    authentication_classes = [CustomTokenAuthentication]
+    permission_classes = [GetRequiresJWTPermission]
+
+    @extend_schema(
+        summary="Создать пачку alert'ов",
+        description=(
+            "Требует Token в заголовке запроса. Принимает список alert'ов (или {\"alerts\": [...]}) "
+            f"до {ALERT_BULK_MAX_ITEMS} штук, камеры ищутся одним запросом, номера выдаются блоком, "
+            "вставка одним запросом. В ответе results в порядке запроса: {\"id\", \"number\"} "
+            "для созданных и {\"error\"} для отклонённых. Alert с уже записанным idempotency_key "
+            "не создаётся повторно, в ответе - его id и номер."
+        ),
+        responses={
+            200: {"description": "Все принятые alert'ы были записаны раньше"},
+            201: {"description": "Создан хотя бы один alert"},
+            400: {"description": "Ошибка запроса или ни один alert не прошёл проверку"},
+            401: {"description": "Отсутствует или неверный Token"},
+        }
+    )
+    def post(self, request):
+        items = request.data.get("alerts") if isinstance(request.data, dict) else request.data
+        if not isinstance(items, list) or not items:
+            return Response({"error": "Ожидается непустой список alert'ов"}, status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > ALERT_BULK_MAX_ITEMS:
+            return Response(
+                {"error": f"Не больше {ALERT_BULK_MAX_ITEMS} alert'ов в одном запросе"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            cameras = cameras_for_alerts(items)
+            # повтор уже записанного alert'а возвращает его, а не создаёт второй
+            keys = [item.get("idempotency_key") for item in items
+                    if isinstance(item, dict) and item.get("idempotency_key")
+                    and isinstance(item.get("idempotency_key"), str)]
+            existing = {
+                alert.idempotency_key: alert
+                for alert in AlertData.objects.filter(idempotency_key__in=keys).only("id", "number", "idempotency_key")
+            } if keys else {}
+
+            results = []
+            alerts = []
+            batch_keys = set()
+            for item in items:
+                key = item.get("idempotency_key") if isinstance(item, dict) else None
+                # ключ не строкой отклонит build_alert, искать его среди записанных нельзя
+                if not isinstance(key, str):
+                    key = None
+                if key in existing:
+                    results.append({"id": existing[key].id, "number": existing[key].number})
+                    continue
+                if key and key in batch_keys:
+                    results.append({"error": "Повторный idempotency_key в пакете"})
+                    continue
+                alert, error = build_alert(item, cameras)
+                if key and not error:
+                    batch_keys.add(key)
+                if error:
+                    results.append({"error": error})
+                else:
+                    results.append(None)
+                    alerts.append(alert)
+
+            try:
+                stored, created = self._create(alerts)
+            except Exception as e:
+                logging.error(f"Ошибка при пакетном создании алертов: {str(e)}", exc_info=True)
+                return Response({"error": "Ошибка при сохранении данных"}, status=500)
+
+            stored_alerts = iter(stored)
+            for index, result in enumerate(results):
+                if result is None:
+                    alert = next(stored_alerts)
+                    results[index] = {"id": alert.id, "number": alert.number}
+            rejected = sum(1 for result in results if "error" in result)
+            if rejected:
+                logging.warning(f"Пакет алертов: отклонено {rejected} из {len(items)}")
+
+            if created:
+                response_status = status.HTTP_201_CREATED
+            elif rejected < len(items):
+                # все принятые alert'ы уже были записаны раньше
+                response_status = status.HTTP_200_OK
+            else:
+                response_status = status.HTTP_400_BAD_REQUEST
+            return Response({"created": created, "results": results}, status=response_status)
+
+        except Exception as e:
+            logging.error(f"Непредвиденная ошибка при обработке пакета: {str(e)}", exc_info=True)
+            return Response(
+                {"error": str(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+    @staticmethod
+    def _create(alerts):
+        """
+        Записывает alert'ы пакета. Возвращает записанные строки в порядке alerts и число созданных.
+        Alert с ключом, который одновременно записал другой запрос, не ломает пакет:
+        в ответ попадает уже записанная строка.
+        """
+        keyless = [alert for alert in alerts if not alert.idempotency_key]
+        keyed = [alert for alert in alerts if alert.idempotency_key]
+        with transaction.atomic():
+            # номера идут в порядке запроса, хотя вставок две
+            assign_alert_numbers(alerts)
+            if keyless:
+                create_alerts_bulk(keyless)
+            if keyed:
+                create_alerts_bulk(keyed, ignore_conflicts=True)
+
+        # при ignore_conflicts id не заполняются: строки с ключами читаются заново
+        rows = {
+            alert.idempotency_key: alert
+            for alert in AlertData.objects.filter(idempotency_key__in=[alert.idempotency_key for alert in keyed])
+            .only("id", "number", "idempotency_key")
+        } if keyed else {}
+        stored = [rows[alert.idempotency_key] if alert.idempotency_key else alert for alert in alerts]
+        # номер уникален, поэтому своя строка отличается от записанной другим запросом номером
+        created = len(keyless) + sum(1 for alert in keyed if rows[alert.idempotency_key].number == alert.number)
+        return stored, created
+
             
 class AlertDataDetailView(APIView):
     authentication_classes = [JWTAuthentication]
@@ -12,6 +12,8 @@ import logging
 
 from rest_framework import status
 
+from api.services.jwt_cache import VerifiedTokenCache
+
 from api.serializers.auth import (
     LoginSerializer,
     LoginResponseSerializer,
@@ -153,6 +155,10 @@ class LogoutAPIView(APIView):
                 if token['user_id'] != request.user.id:
                     return Response({"ошибка": "другой пользователь"}, status=status.HTTP_403_FORBIDDEN)
                 token.blacklist()
+                # access токен из cookie больше не принимается из кэша проверенных токенов
+                access_token = request.COOKIES.get('access_token')
+                if access_token:
+                    VerifiedTokenCache().revoke(access_token)
             except Exception as e:
                 return Response({"ошибка": f"refresh token: {str(e)}"}, status=status.HTTP_401_UNAUTHORIZED)
     